@@ -1,174 +1,260 @@
-import ssl
-import json
-from urllib.request import urlopen
-
-import numpy as np
-import pandas as pd
+import uuid
+from functools import partial
 
 import streamlit as st
-import plotly.express as px
-import plotly.graph_objects as go
-import plotly.express.colors as pc
 
+from sdoh_dashboard import (association, bundle, config, dataset, figures, geometry, instrument, precompute, prefetch,
+                            query, reload, shared, tracts)
+from sdoh_dashboard.cache import LRUCache
+from sdoh_dashboard.figure_cache import FigureCache
+from sdoh_dashboard.metadata import (sdoh_options, lab_options, dict_sdohLabels, dict_sdohDescriptions,
+                                     dict_labLabels)
 
-ssl._create_default_https_context = ssl._create_unverified_context
 
-# File Authentication
-# @st.cache_data
-def load_json():
-    try:
-        with urlopen('https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json') as response:
-            return json.load(response)
-    
-    except json.decoder.JSONDecodeError as error:
-        st.write("Failed to load JSON data - Check Interntet Connection or Server Data Fetch Request:", error)
-        st.write("")
-        
-        print("Failed to load JSON data - Check Interntet Connection or Server Data Fetch Request:", error)
-        print("")
-    
+# Streamlit entry point: caching and page layout, everything else lives in the sdoh_dashboard package
+
+# SDOHs and Labs columns, all of them are needed by the color tables and correlations
+DATA_COLUMNS = config.MAP_COLUMNS + tuple(lab_options) + tuple(sdoh_options)
+
+
+# Data frames and bundles keyed by file signature, in caches owned here rather than by st.cache_resource, so the
+# hot reload can drop the entries of replaced files (per-entry clear() needs a newer Streamlit than the pin)
+@st.cache_resource(show_spinner=False)
+def data_cache():
+    return LRUCache(maxsize=64)
+
+
+@st.cache_resource(show_spinner=False)
+def bundle_cache():
+    return LRUCache(maxsize=8)
+
 
 # Data Frame Creation
-@st.cache_data
-def load_data():
-    sdoh_path = "sdoh.csv"
-    return pd.read_csv(sdoh_path, dtype={"COUNTYFIPS":str, "STATEFIPS":str}, low_memory=False)
-    
+# Reads only the given columns of a year's partition, or of the current dataset (sdoh.parquet when built,
+# else sdoh.csv). Held once per process and shared read-only by all sessions (no per-call copies), the
+# signature invalidates it. The least recently used years and selections are dropped past 64 entries.
+def load_data(columns, signature, year=None):
+    return data_cache().get_or_build((columns, signature, year),
+                                     lambda: shared.freeze_frame(dataset.read(columns, year)))
+
+
+# Content hash of the dataset, computed once per signature (and year) instead of on every rerun
+@st.cache_resource(show_spinner=False, max_entries=64)
+def load_version(_sdoh, signature, year=None):
+    return derived(signature, dataset.version(_sdoh))
+
+
+# Precompiled bundle (dataset, counties and tables), memory-mapped once per process and shared read-only.
+# None when it was not built or is out of date.
+def load_bundle(signature, dataset_signature, geometry_signature):
+    return bundle_cache().get_or_build((signature, dataset_signature, geometry_signature),
+                                       partial(_load_bundle, signature))
+
+
+def _load_bundle(signature):
+    assets = bundle.load(signature[0][0]) if signature else None
+    if assets is None:
+        return None
+    derived(signature, assets.version)
+    return assets._replace(data=shared.freeze_frame(assets.data),
+                           counties=assets.counties._replace(geojson=shared.freeze_json(assets.counties.geojson)),
+                           tables=shared.freeze_tables(assets.tables))
+
+
+# Counties at the selected level of detail, held once per process and shared read-only
+@st.cache_resource(show_spinner=False, max_entries=8)
+def load_counties(fips, signature):
+    counties = geometry.load_counties(fips)
+    derived(signature, counties.version)
+    return counties._replace(geojson=shared.freeze_json(counties.geojson))
+
+
+# Color bins, tick labels and colorbar limits of every SDOH and lab, computed once per dataset version
+@st.cache_resource(show_spinner=False, max_entries=64)
+def load_tables(_sdoh, version):
+    return shared.freeze_tables(precompute.precompute(_sdoh, sdoh_options, lab_options, figures.lab_colorscale()))
+
+
+# Census tract level: tract data, color tables and the municipios' lab dots, once per file signature
+@st.cache_resource(show_spinner="Loading the census tracts...", max_entries=8)
+def load_tract_level(_sdoh, signature, version):
+    level = tracts.load(_sdoh, figures.lab_colorscale())
+    derived(signature, level.version)
+    return level._replace(data=shared.freeze_frame(level.data),
+                          tables=shared.freeze_tables(level.tables),
+                          dots=shared.freeze_frame(level.dots),
+                          dots_tables=shared.freeze_tables(level.dots_tables))
+
+
+# Census tracts at the selected level of detail, held once per process and shared read-only
+@st.cache_resource(show_spinner=False, max_entries=8)
+def load_tracts(fips, signature):
+    tract_geometry = tracts.load_tracts(fips)
+    derived(signature, tract_geometry.version)
+    return tract_geometry._replace(geojson=shared.freeze_json(tract_geometry.geojson))
+
+
+# URL of the counties published under the static folder (None without static file serving), once per version
+@st.cache_resource(show_spinner=False, max_entries=8)
+def counties_url(_counties, version):
+    if not st.get_option("server.enableStaticServing"):
+        return None
+    return geometry.publish(_counties.geojson, version)
+
+
+# Animated map over every year, each year's data and tables are loaded (or taken from the caches) in turn
+def build_animated_figure(years, signature, geojson, lab_selection, sdoh_selection):
+    years_data, years_tables = {}, {}
+    for year in years:
+        years_data[year] = load_data(DATA_COLUMNS, signature, year)
+        years_tables[year] = load_tables(years_data[year], load_version(years_data[year], signature, year))
+    return figures.build_animated_figure(years_data, geojson, years_tables, lab_selection, sdoh_selection)
+
+
+# Lab x SDOH correlations with bootstrap confidence intervals, computed once per dataset version
+# (and cached on disk across restarts)
+@st.cache_resource(show_spinner="Computing the lab and SDOH correlations...", max_entries=64)
+def load_associations(_sdoh, version):
+    return association.load(_sdoh, version, lab_options, sdoh_options)
+
+
+# Whether the plotly.js bundled with the installed Streamlit decodes typed arrays (2.28+), by Streamlit version
+def typed_arrays():
+    return tuple(int(part) for part in st.__version__.split(".")[:2]) >= config.TYPED_ARRAYS_STREAMLIT
+
+
+# A map's builder, made to build the compact figure (see figures.compact_figure) unless SDOH_COMPACT_FIGURES=0
+def compact(build, geojson_url=None):
+    if not config.COMPACT_FIGURES:
+        return build
+    return lambda: figures.compact_figure(build(), geojson_url, typed_arrays())
+
+
+# Figures shared by all sessions
+@st.cache_resource(show_spinner=False)
+def figure_cache():
+    return FigureCache(maxsize=config.FIGURE_CACHE_SIZE)
 
 
-# Columns and Labels to use in "SDOHs Dropdown Menu"
-sdoh_options = [
-    # poverty
-    "ACS_PCT_INC50_ABOVE65",          
-    "ACS_PCT_HEALTH_INC_BELOW137",
-    "ACS_PCT_HEALTH_INC_138_199",
-    "ACS_PCT_HEALTH_INC_200_399",
-    "ACS_PCT_HEALTH_INC_ABOVE400",
-    "ACS_PCT_HH_PUB_ASSIST",
-    # education
-    "ACS_PCT_COLLEGE_ASSOCIATE_DGR",
-    "ACS_PCT_BACHELOR_DGR",
-    "ACS_PCT_GRADUATE_DGR",
-    "ACS_PCT_HS_GRADUATE",
-    "ACS_PCT_LT_HS",
-    "ACS_PCT_POSTHS_ED",
-    # employment
-    "ACS_TOT_CIVIL_EMPLOY_POP",
-    # insurance coverage
-    "ACS_PCT_UNINSURED",
-    # healthcare access
-    "HIFLD_MIN_DIST_UC",
-    "POS_MIN_DIST_ED",
-    "POS_MIN_DIST_ALC",
-    # disability
-    "ACS_PCT_DISABLE",
-    "ACS_PCT_NONVET_DISABLE_18_64",
-    "ACS_PCT_VET_DISABLE_18_64",
-    # mental health
-    "MMD_ANXIETY_DISD",
-    "MMD_DEPR_DISD"
-    ]        
-
-labels_for_counties = [
-    # poverty
-    "Percentage of People Under 0.50 of the Income-to-Poverty Ratio (Ages 65 and over) ",
-    "Percentage of People Under 1.37 of the Poverty Threshold ",
-    "Percentage of People Between 1.38 and 1.99 of the Poverty Threshold ",
-    "Percentage of People Between 2.00 and 3.99 of the Poverty Threshold ",
-    "Percentage of People Over 4.00 of the Poverty Threshold ",
-    "Percentage of Families With Public Income or Food Asssitance ",
-    # education
-    "Percentage of People with Some College or Associate's Degree (Ages 25 and over) ",
-    "Percentage of People with a Bachelor's Degree (Ages 25 and over) ",
-    "Percentage of People with a Master's Degree, Professional School Degree, or Doctoral Degree (Ages 25 and over) ",
-    "Percentage of People with only high school diploma (Ages 25 and over) ",
-    "Percentage of People with Less Than High School Education (Ages 25 and over) ",
-    "Percentage of People With Any Postsecondary Education (Ages 25 and over) ",
-    # employment
-    "Number of Employed Civilians (Thousands) ",
-    # insurance converage
-    "Percentage of People without Health Insurance Coverage ",
-    # healthcare access
-    "Miles to Nearest Urgent Care ",
-    "Distance in Miles to the Nearest Emergency Department ",
-    "Distance in Miles to the Nearest Hospital With Alcohol and Drug Abuse Inpatient Care ",
-    # disability
-    "Percentage of People with a Disability ",
-    "Percentage of Nonveteran Civilians With a Disability (Ages Between 18 and 64) ",
-    "Percentage of Veteran Civilians With a Disability (Ages Between 18 and 64) ",
-    # mental health
-    "Prevalence of Anxiety Disorders Among Medicare Beneficiaries ",
-    "Prevalence of Depressive Disorders Among Medicare Beneficiaries "
-    ]
-
-descriptions_for_counties = [
-    # poverty
-    "Percentage of People with Ratio of Income to Poverty Ratio Under 0.50 (Ages 65 and over)."
-    " (Income-to-Poverty Ratio (IPR)- Total Family Income divided by the Poverty Threshold).",
-    "Percentage of People Under 1.37 of the Poverty Threshold (Relevant for Health Insurance Coverage)."
-    " (Measured by the Annual Cost of Necessities).",
-    "Percentage of People Between 1.38 and 1.99 of the Poverty Threshold (Relevant for Health Insurance Coverage)."
-    " (Measured by the Annual Cost of Necessities).",
-    "Percentage of People Between 2.00 and 3.99 of the Poverty Threshold (Relevant for Health Insurance Coverage)."
-    " (Measured by the Annual Cost of Necessities).",
-    "Percentage of People Over 4.00 of the Poverty Threshold (Relevant for Health Insurance Coverage)."
-    " (Measured by the Annual Cost of Necessities).",
-    "Percentage of Families that receive Public Assistance Income or Food Stamps/SNAP." 
-    " (Supplemental Nutrition Assistance Program).",
-    # education
-    "Percentage of People with Some College or Associate's Degree (Ages 25 and over).",
-    "Percentage of People with a Bachelor's Degree (Ages 25 and over).",
-    "Percentage of People with a Master's Degree, Professional School Degree, or Doctoral Degree (Ages 25 and over).",
-    "Percentage of People with Only High School Diploma (Ages 25 and over).",
-    "Percentage of People With Less Than a High School Education (Ages 25 and over).",
-    "Percentage of People With Any Postsecondary Education (Ages 25 and over).",
-    # employment
-    "Number (Thousands) of Employed Civilians (Ages 16 and over).",
-    # insurance converage
-    "Percentage of People Without Health Insurance Coverage.",
-    # healthcare access
-    "Distance in Miles to the Nearest Urgent Care Center (based on ZIP Codes).",
-    "Distance in Miles to the Nearest Emergency Department (based on ZIP Codes).",
-    "Distance in Miles to the Nearest Hospital With Alcohol and Drug Abuse Inpatient Care (based on ZIP Codes).",
-    # disability
-    "Percentage of People with a Disability.",
-    "Percentage of Nonveteran Civilians With a Disability (Ages Between 18 and 64).",
-    "Percentage of Veteran Civilians With a Disability (Ages Between 18 and 64).",
-    # mental health
-    "Prevalence of Anxiety Disorders Among Medicare (Dual and Non-dual) Beneficiaries.",
-    "Prevalence of Depressive Disorders Among Medicare (Dual and Non-dual) Beneficiaries."
-    ]    
-
-sdoh_tickvals=[3000000, 4000000, 5000000, 6000000, 7000000, 8000000, 9000000, 10000000, 
-               11000000, 12000000, 13000000, 14000000, 15000000, 16000000, 17000000]
-
-dict_sdohLabels = dict(zip(sdoh_options, labels_for_counties))
-
-dict_sdohDescriptions = dict(zip(sdoh_options, descriptions_for_counties))
-
-
-
-# Columns and Labels to use in "Labs Menu"
-lab_options = ["albumin_urine", "bun", "creatinine_serum", "creatinine_urine"]
-
-labels_for_dots = ["Average of Albumin Urine lab test ", 
-                   "Average of Blood Urea Nitrogen lab test ", 
-                   "Average of Creatinine Serum lab test ", 
-                   "Average of Creatinine Urine lab test "]
-
-lab_dticks = [5, 2, 0.1, 15]
-
-
-dict_labLabels = dict(zip(lab_options, labels_for_dots))
-dict_labsDticks = dict(zip(lab_options, lab_dticks))
-
-
-
-# Dictionary with all labels
-dict_Labels = {**dict_labLabels, **dict_sdohLabels}
-dict_Labels["COUNTY"] = "County "
+# Background builds of the pairs likely to be picked next, shared by all sessions
+@st.cache_resource(show_spinner=False)
+def prefetcher():
+    return prefetch.Prefetcher(figure_cache())
 
 
+# Builder of a selection pair's map from the data of every column (reruns, hot reload and prefetch)
+def pair_builder(sdoh, counties, tables, lab_selection, sdoh_selection, geojson_url):
+    return compact(partial(figures.build_figure, sdoh, counties.geojson, tables, lab_selection, sdoh_selection),
+                   geojson_url)
+
+
+# Serialized size of a cached figure, computed once per figure (only when instrumenting), as many as the figures
+@st.cache_resource(show_spinner=False, max_entries=config.FIGURE_CACHE_SIZE)
+def figure_bytes(_figure, key):
+    return len(_figure.to_json().encode())
+
+
+# Versions (content hashes) of what was built from each file signature, used to find the figures of replaced files
+@st.cache_resource(show_spinner=False)
+def derived_versions():
+    return {}
+
+
+def derived(signature, version):
+    derived_versions().setdefault(signature, set()).add(version)
+    return version
+
+
+# Hot reload, step 1: with the changed files' new signatures, builds what the first rerun needs (data, counties,
+# tables and correlations of the year shown first, census tracts) and the maps cached for the previous files
+def warm(changed, signatures):
+    assets = load_bundle(signatures["bundle"], signatures["dataset"], signatures["geometry"])
+    sdoh = assets.data if assets else load_data(DATA_COLUMNS, signatures["dataset"])
+    counties = assets.counties if assets else load_counties(tuple(sdoh["COUNTYFIPS"]), signatures["geometry"])
+    geojson_url = counties_url(counties, counties.version)
+    version = assets.version if assets else load_version(sdoh, signatures["dataset"])
+    if tracts.available():
+        tract_data = load_tract_level(sdoh, signatures["tracts"], version)
+        load_tracts(tuple(tract_data.data[tracts.TRACT_COLUMN]), signatures["tracts"])
+
+    years = dataset.signature_years(signatures["dataset"])
+    if len(years) > 1:
+        sdoh = load_data(DATA_COLUMNS, signatures["dataset"], years[-1])
+        version = load_version(sdoh, signatures["dataset"], years[-1])
+        tables = load_tables(sdoh, version)
+    else:
+        tables = assets.tables if assets else load_tables(sdoh, version)
+    load_associations(sdoh, version)
+
+    pairs = {key[:2] for key in figure_cache().keys() if len(key) == 4 and key[0] in lab_options}
+    for lab_selection, sdoh_selection in pairs | {(lab_options[0], sdoh_options[0])}:
+        figure_cache().lookup((lab_selection, sdoh_selection, version, counties.version),
+                              pair_builder(sdoh, counties, tables, lab_selection, sdoh_selection, geojson_url))
+
+
+# Hot reload, step 3: once the new signatures are published, drops the figures built from the replaced files
+# and their largest cached data. Other stale entries are never used again and age out of their caches.
+def drop(changed, old, new):
+    versions = derived_versions()
+    current = set().union(*(versions.get(signature, ()) for signature in new.values()))
+    stale = {old[name] for name in changed}
+    stale |= set().union(*(versions.pop(signature, ()) for signature in stale)) - current
+    figure_cache().discard(lambda key: any(part in stale for part in key))
+
+    bundle_cache().discard(lambda key: key == (old["bundle"], old["dataset"], old["geometry"]))
+    if "dataset" in changed:
+        data_cache().discard(lambda key: key[1] == old["dataset"])
+
+
+# Signatures of the data files in use, checked for changes in the background (see sdoh_dashboard/reload.py)
+@st.cache_resource(show_spinner=False)
+def watcher():
+    return reload.Watcher({"dataset": dataset.signature,
+                           "geometry": geometry.signature,
+                           "tracts": tracts.signature,
+                           "bundle": bundle.signature},
+                          warm, drop).start()
+
+
+# Query layer over a dataset version (sdoh_dashboard/query.py): FIPS index and sorted orders, built once
+@st.cache_resource(show_spinner=False, max_entries=8)
+def load_store(_sdoh, version):
+    return query.Store(_sdoh, version)
+
+
+# Store of the current dataset, from the published signatures (called by the query endpoint's threads)
+def current_store():
+    signatures = watcher().signatures
+    assets = load_bundle(signatures["bundle"], signatures["dataset"], signatures["geometry"])
+    sdoh = assets.data if assets else load_data(DATA_COLUMNS, signatures["dataset"])
+    return load_store(sdoh, assets.version if assets else load_version(sdoh, signatures["dataset"]))
+
+
+# Local HTTP endpoint of the query layer on SDOH_QUERY_PORT, started once per process. None when the port is
+# taken (e.g. by another server process).
+@st.cache_resource(show_spinner=False)
+def query_server():
+    try:
+        return query.serve(current_store, config.QUERY_PORT)
+
+    except OSError as error:
+        print("Query endpoint not started on port %d: %s" % (config.QUERY_PORT, error))
+        return None
+
+
+# A query's result as CSV or Parquet bytes, once per dataset version
+@st.cache_resource(show_spinner=False, max_entries=64)
+def export(_store, version, columns, output):
+    frame = _store.query(columns=columns)
+    return b"".join(query.iter_csv(frame)) if output == "csv" else query.to_parquet(frame)
+
+
+# Query parameter value, on Streamlit versions with and without st.query_params
+def query_param(name):
+    if hasattr(st, "query_params"):
+        return st.query_params.get(name)
+    return (st.experimental_get_query_params().get(name) or [None])[0]
+
 
 ########################################
 # --DASHBOARD APPLICATION START LINE-- #
@@ -182,8 +268,39 @@ st.set_page_config(layout="wide",
                                "About":"Dashboard with Kidney Disease Lab Data and Social Determinants of Health Indices"})
 
 
-counties = load_json()  # Puerto Rico's Map Information
-sdoh = load_data()      # SDOHs and Labs Data
+# Rerun's Timing Spans (opt-in), "?debug=1" also shows them at the bottom of the page
+debug = query_param("debug") == "1"
+rerun = instrument.Rerun(enabled=config.INSTRUMENT or debug,
+                         session=st.session_state.setdefault("session_id", uuid.uuid4().hex[:12]))
+
+
+try:
+    with rerun.span("load_data"):
+        files = watcher()
+        if config.QUERY_PORT:
+            query_server()
+        if not config.RELOAD_INTERVAL:
+            files.poll(settle=False)
+        # Read once: a reload published during this rerun is only seen by the next one
+        signatures = files.signatures
+        # The bundle's content hash is then the version of the data, the counties and everything built from them
+        assets = load_bundle(signatures["bundle"], signatures["dataset"], signatures["geometry"])
+        sdoh = assets.data if assets else load_data(DATA_COLUMNS, signatures["dataset"])  # SDOHs and Labs Data
+
+except OSError as error:
+    st.error("Failed to load the SDOH dataset - Check sdoh.csv or sdoh.parquet: %s" % error)
+    print("Failed to load the SDOH dataset - Check sdoh.csv or sdoh.parquet:", error)
+    st.stop()
+
+try:
+    with rerun.span("load_counties"):
+        # Puerto Rico's Map Information
+        counties = assets.counties if assets else load_counties(tuple(sdoh["COUNTYFIPS"]), signatures["geometry"])
+
+except (OSError, ValueError) as error:
+    st.error("Failed to load the counties map data - Check the bundled GeoJSON or Internet Connection: %s" % error)
+    print("Failed to load the counties map data - Check the bundled GeoJSON or Internet Connection:", error)
+    st.stop()
 
 
 # st.markdown("""<style>
@@ -246,273 +363,222 @@ st.markdown("""<style>
 st.markdown(body="<br><br>", unsafe_allow_html=True)
 
 ### Dropdown Menus and SDoHs Descriptions ###
-col1, col2 = st.columns([0.20, 0.80], gap="medium")
-
-with col1:
-    # st.markdown(body="##### Select the Kidney lab test")
-    st.markdown("""<p style="text-align:left; font-weight:bold; font-size:22px">
-                   <br><br>Select the Kidney lab test
-                </p>""", unsafe_allow_html=True)
+# Client-side selection: the map carries every lab and SDOH, and its own menus switch them in the browser
+client_selection = config.SELECTION_MODE == "client" or query_param("selection") == "client"
+
+if client_selection:
+    col2 = st.container()
+    lab_selection = sdoh_selection = None
+    tract_level = False
+
+else:
+    col1, col2 = st.columns([0.20, 0.80], gap="medium")
+
+    with col1:
+        # Geography Level, offered when the census tract data and GeoJSON are available
+        tract_level = False
+        if tracts.available():
+            tract_level = st.radio(key="geography",
+                                   label="**Geography**",
+                                   options=["county", "tract"],
+                                   index=int(config.GEOGRAPHY == "tract"),
+                                   format_func={"county": "Municipios", "tract": "Census tracts"}.get,
+                                   horizontal=True) == "tract"
+
+        # st.markdown(body="##### Select the Kidney lab test")
+        st.markdown("""<p style="text-align:left; font-weight:bold; font-size:22px">
+                       <br><br>Select the Kidney lab test
+                    </p>""", unsafe_allow_html=True)
     
-    # Labs Menu
-    lab_selection = st.selectbox(key="current_lab",
-                                 label="**Select the Kidney lab test**", 
-                                 label_visibility="collapsed",
-                                 options=lab_options,
-                                 index=0,
-                                 format_func=lambda y: dict_labLabels[y])
-                                 # format_func=lambda y: str(lab_options.index(y)+1) + ". " + dict_labLabels[y])
-
-    # SDOHs Menu
-    # st.markdown(body="##### Select the SDoH")
-    st.markdown("""<p style="text-align:left; font-weight:bold; font-size:22px">
-                    <br><br><br><br>Select the SDoH
-                </p>""", unsafe_allow_html=True)
+        # Labs Menu
+        lab_selection = st.selectbox(key="current_lab",
+                                     label="**Select the Kidney lab test**", 
+                                     label_visibility="collapsed",
+                                     options=lab_options,
+                                     index=0,
+                                     format_func=lambda y: dict_labLabels[y])
+                                     # format_func=lambda y: str(lab_options.index(y)+1) + ". " + dict_labLabels[y])
+
+        # SDOHs Menu
+        # st.markdown(body="##### Select the SDoH")
+        st.markdown("""<p style="text-align:left; font-weight:bold; font-size:22px">
+                        <br><br><br><br>Select the SDoH
+                    </p>""", unsafe_allow_html=True)
     
-    sdoh_selection = st.selectbox(key="current_sdoh",
-                                  label="**Select the SDOH**", 
-                                  label_visibility="collapsed",
-                                  options=sdoh_options, 
-                                  index=0, 
-                                  format_func=lambda x: dict_sdohLabels[x])
-                                  # format_func=lambda x: str(sdoh_options.index(x)+1) + ". " + dict_sdohLabels[x])
+        # Tract level: its data is loaded here, only the SDOHs published for tracts are offered
+        if tract_level:
+            try:
+                with rerun.span("load_tracts"):
+                    tract_data = load_tract_level(sdoh, signatures["tracts"],
+                                                  assets.version if assets else load_version(sdoh, signatures["dataset"]))
+                    tract_geometry = load_tracts(tuple(tract_data.data[tracts.TRACT_COLUMN]), signatures["tracts"])
+
+            except (OSError, ValueError) as error:
+                st.error("Failed to load the census tracts - Check sdoh_tract.csv and geojson-tracts-pr.json: %s" % error)
+                print("Failed to load the census tracts - Check sdoh_tract.csv and geojson-tracts-pr.json:", error)
+                st.stop()
+
+        sdoh_selection = st.selectbox(key="current_sdoh",
+                                      label="**Select the SDOH**", 
+                                      label_visibility="collapsed",
+                                      options=tract_data.sdoh_options if tract_level else sdoh_options, 
+                                      index=0, 
+                                      format_func=lambda x: dict_sdohLabels[x])
+                                      # format_func=lambda x: str(sdoh_options.index(x)+1) + ". " + dict_sdohLabels[x])
     
-    st.markdown(body="")
-    sdoh_description = st.markdown(body=dict_sdohDescriptions[sdoh_selection],
-                                   help=dict_sdohLabels[sdoh_selection])
-
-
-
-# Dictionary for ticks information
-arange = np.arange(start=0.0, stop=1.01, step=0.0588)
-sdoh_describe = sdoh[sdoh_selection].describe(percentiles=arange)
-sdoh_describe.pop("50%")
-percentiles_vals = sdoh_describe[7:-1].values
-
-sdoh_ticktexts=(np.rint(percentiles_vals)).astype(int)
-
-
-### Puerto Rico Choropleth Map containing Counties with SDOH Data ###
-mapp = px.choropleth(data_frame=sdoh,                                        # dataframe to use
-                     geojson=counties,                                       # establishes coordinates of Puerto Rico to trace its map
-                     locations="COUNTYFIPS",                                 # determines considered locations, used for plot traces and updates
-                     labels=dict_Labels,                                     # labels for labs and sdohs
-                     hover_name="COUNTY",                                    # counties names
-                     # hover_data={sdoh_selection:True, "COUNTYFIPS":False}, # info contained in counties
-                     hover_data={lab_selection:":.1f", sdoh_selection:":.0f",
-                                 "COUNTYFIPS":False},
-                     # color=dict_sdohColors[sdoh_selection],                # counties color intensities
-                     # color_continuous_scale=pc.sequential.Purples,         # color scale for color intensities
-                     # range_color=[0.35, 1],                                # min and max color intensities for counties
-                     )      
-                     
-# Geographical Map Design
-mapp.update_geos(scope="world",                         # sets section of world map
-                 fitbounds=False,                       # removes mapping of locations with geojson coordinates, same as <fitbounds> in px.choropleth(...)
-                 visible=False,                         # removes all other countries and continents, same as <basemap_visible> in px.choropleth(...)
-                 center=dict(lat=18.155, lon=-66.245),  # sets center coordinates of the figure's map projection
-                 bgcolor="#f5f5f5",                     # background color name: "whitesmoke"
-                 projection_scale=172,                  # sets the map's initial zoom and projection type
-                 # showframe=True,                       # shows the border lines of the map's plot box
-                 )
-
-# Map's Figure Layout
-mapp.update_layout(autosize=False,                                      # allows custom size
-                   margin=dict(autoexpand=True, r=0, t=0, l=0, b=0),    # figure's boundaries, distance from the plot's borders to the container's borders
-                   
-                   # width=1425,                                          # map horizontal size/length, same as <width> in px.choropleth(...)
-                   # height=712.5,                                          # map vertical size/length, same as <height> in px.choropleth(...)
-                   # width=1375,
-                   # height=687.5,
-                   # width=1100,
-                   height=650,
-                                      
-                   paper_bgcolor="#f5f5f5",                             # application background color
-                   # paper_bgcolor="indigo",
-                   
-                   dragmode=False,                                      # disables dragging of the map figure
-                   modebar=dict(color="#303030", 
-                                activecolor="#d303fc", 
-                                bgcolor="#f5f5f5",
-                                remove=["zoomIn", "zoomOut", "select",  # disables modebar's options 
-                                        "lasso", "pan", "reset"]),
-                   
-                   # title=dict(                       # Main Title Design
-                   #     automargin=True,              
-                   #     pad=dict(t=0, l=0, b=0, r=0),  
-                   #     x=0.50,                        
-                   #     y=0.90, 
-                   #     xref="paper", 
-                   #     yref="paper", 
-                   #     xanchor="center",
-                   #     yanchor="top",
-                   #     text="Puerto Rico<br>", 
-                   #     "SDOHs-Kidney Disease",       
-                   #     font=dict(color="purple", family="Rockwell", size=16)), 
-                   
-                   
-                   showlegend=False,
-                   # legend=dict(                       # Legend Design 
-                   #    x=0.60, 
-                   #    y=-0.175,
-                   
-                   #    bgcolor="#f5f5f5",              # legend background color
-                   #    bordercolor="black",            # legend border lines color
-                   #    borderwidth=0.75,               # legend border lines thickness 
-                   #    
-                   #    entrywidth=1,                   # space between symbols and labels
-                   #    entrywidthmode="pixels",        # determines unit of measurement
-                   #    itemwidth=30,                   # size of symbols inside the legend
-                   #    traceorder="reversed",
-                   #    
-                   #    title=dict(side="top",                                  # legend's title text properties
-                   #               text="Legend",                   
-                   #               font=dict(color="black", family="Rockwell", size=14)))
-                   #    font=dict(color="black", family="Rockwell", size=13),   # legend's labels text properties
-                   )
-
-# Map's Traces Properties
-mapp.update_traces(visible=True,
-                   name=dict_sdohLabels[sdoh_selection],                # new name of symbol
-                   z=sdoh["color_"+sdoh_selection],
-                   # z=sdoh[dict_sdohColors[sdoh_selection]],
-                   # z=sdoh[sdoh_selection],
-                   # zauto=False,                                       # allows custom inferior/superior limits & midpoint
-                   # zmin=sdoh[sdoh_selection].min(),
-                   # zmax=sdoh[sdoh_selection].max(),     
-                   
-                   marker=dict(line=dict(color="#303030", width=1.5), opacity=0.925),
-                   
-                   showscale=True,
-                   autocolorscale=False,
-                   colorscale=pc.sequential.Purples,
-                   reversescale=False,
-
-                   
-                   showlegend=False,                     # allows to be shown in the legend
-                   legendrank=1,                         # first symbol in the legend
-                   legendwidth=10,                       # width of legend box
-                   
-                   colorbar=dict(
-                       orientation="h",                  # sets the colorscale bar to be drawn horizontaly
-                       outlinecolor="black",             # sets the color of the bar's borders
-                       outlinewidth=1.05,                # sets thickness of the borders' lines
-                       
-                       x=0.72,
-                       y=0.025,                    
-                       
-                       thickness=13,                     # thickness size of the bar
-                       len=0.40,                         # length of the bar                       
-                       
-                       title=dict(
-                           side="bottom",
-                           text=dict_sdohLabels[sdoh_selection],
-                           font=dict(color="#303030", family="Rockwell", size=11)),   
-                       
-                       tickmode="array",
-                       tickvals=sdoh_tickvals,
-                       ticktext=sdoh_ticktexts,
-                       # tickformat=".0f",
-                       # ticksuffix="%",
-                       ticks="inside",
-                       tickwidth=1.35,
-                       ticklen=3.5,
-                       tickcolor="black",
-                       tickfont=dict(color="#303030", family="Rockwell", size=10))
-                  )
-
-
-
-
-# Puerto Rico Scattergeo Map containing County Coordinate with Lab Data
-# Counties without lab data: Añasco, Florida, Hormigueros, Las Marías, and Orocovis
-dots = px.scatter_geo(data_frame=sdoh,
-                      lat="lat",
-                      lon="lon",
-                      fitbounds="locations",
-                      labels=dict_Labels,                                          # labels for labs and sdohs
-                      hover_name="COUNTY",                                         # title of the dots' hoverboxes
-                      hover_data={lab_selection:":.1f", sdoh_selection:":.0f",     # information contained inside dots
-                                  "lat":False, "lon":False}
-                      # color="creatinine_serum",                                  # dots color intensities
-                      # color_continuous_scale=pc.sequential.Oranges,              # color scale for color intensities
-                      # range_color=[0.30, 1.0],                                   # min and max color intensities for dots 
-                      # opacity=0.75,                                              # transparency level for dots 
-                      )
-
-# Dot's Figure Layout
-dots.update_layout(margin=dict(r=0, t=0, l=0, b=0),
-                   autosize=False,                   # allows custom size                   
-                   showlegend=False)                        
-
-# Map's Traces Properties 
-dots.update_traces(showlegend=False,                                      # allows to be shown in the legend
-                   legendrank=2,                                          # second symbol in the legend
-                   name=dict_labLabels[lab_selection],                    # sets the trace name in the legend and on datum hover 
-                   
-                   hoverlabel=dict(align="left",                          # sets text to be aligned to the left
-                                   # bgcolor="darkorange",                # hoverbox background color
-                                   bordercolor="black"),                  # hoverbox edges color
-                   
-                   # selected_marker=dict(opacity=1, size=10),
-                   marker=dict(
-                       size=9,                                            # size of dots, same as <size> in px.scatter_geo(...)
-                       line=dict(width=1.25, color="#303030"),            # dots borders line thickness & color
-
-                       color=sdoh["color_"+lab_selection],                # determines color intensities
-                       # color=sdoh[dict_labColors[lab_selection]],
-                       opacity=0.90,
-                       cauto=False,                                       # allows custom inferior/superior limits & midpoint
-                       cmin=sdoh[lab_selection].min(),
-                       cmax=sdoh[lab_selection].max(),
-                       
-                       showscale=True,                                    # displays scale values-to-color-intensities
-                       autocolorscale=False,                              # allows custom colorscale
-                       colorscale="Oranges",                              # determines color scale for color intensities
-                       reversescale=False,                                # reverses bright and dark values
-                       
-                       colorbar=dict(
-                           orientation="h",                               # sets the colorscale bar to be drawn horizontaly
-                           outlinecolor="black",                          # sets the color of the bar's borders
-                           outlinewidth=1.05,                             # sets thickness of the borders' lines
-                           
-                           x=0.28,
-                           y=0.025,                      
-                           
-                           thickness=13,                                   # thickness size of the bar
-                           len=0.40,                                       # length of the bar
-                           
-                           title=dict(
-                               side="bottom",
-                               text=dict_labLabels[lab_selection],
-                               font=dict(color="#303030", family="Rockwell", size=11)), 
-                           
-                           tickmode="linear",
-                           tick0=0,
-                           dtick=dict_labsDticks[lab_selection],
-                           # tickformat=".1f",
-                           ticks="inside",
-                           tickwidth=1.30,
-                           ticklen=4,
-                           tickcolor="black",
-                           tickfont=dict(color="#303030", family="Rockwell", size=10)))          
-                   )
-
-
-
-# Combines the Dots Traces of the Scattergeo Map with the Counties Traces of the Choropleth Map, 
-# based on Puerto Rico's Coordinates.
-mapp.append_trace(dots.data[0], row="all", col="all")
+        st.markdown(body="")
+        sdoh_description = st.markdown(body=dict_sdohDescriptions[sdoh_selection],
+                                       help=dict_sdohLabels[sdoh_selection])
+
+
+
+### Year Slider ###
+# Shown when there are several yearly partitions, each year is only loaded when first shown. With the
+# animation, the map's own slider and play button switch the years in the browser.
+years = dataset.signature_years(signatures["dataset"])
+year = None
+animate = False
+
+if len(years) > 1 and not tract_level:
+    with col2:
+        animate = not client_selection and st.toggle(key="animate_years",
+                                                     label="Animate all years (%d-%d)" % (years[0], years[-1]))
+        year = years[-1] if animate else st.select_slider(key="current_year",
+                                                          label="**Year**",
+                                                          options=years,
+                                                          value=years[-1])
+
+    with rerun.span("load_data"):
+        sdoh = load_data(DATA_COLUMNS, signatures["dataset"], year)
+
+
+# The bundle holds the current dataset's tables, a year's partition gets its own
+bundled = assets is not None and year is None
+
+with rerun.span("load_tables"):
+    if bundled:
+        sdoh_version, tables = assets.version, assets.tables
+    else:
+        sdoh_version = load_version(sdoh, signatures["dataset"], year)
+        tables = load_tables(sdoh, sdoh_version)
+
+with rerun.span("load_associations"):
+    associations = load_associations(sdoh, sdoh_version)
+
+# Correlation of the current pair, below the SDOH description
+if not client_selection:
+    with col1:
+        pair = associations.loc[(lab_selection, sdoh_selection)]
+        st.markdown(body="**Correlation across %d municipios with lab data**  \n"
+                         "Pearson r = %.2f (95%% CI %.2f to %.2f)  \n"
+                         "Spearman ρ = %.2f (95%% CI %.2f to %.2f)"
+                         % (pair["n"], pair["pearson"], pair["pearson_low"], pair["pearson_high"],
+                            pair["spearman"], pair["spearman_low"], pair["spearman_high"]),
+                    help="95%% confidence intervals from %d bootstrap resamples of the municipios" % association.N_BOOTSTRAP)
+
+### Comparison Grid ###
+# Several SDoHs side by side (one row per lab's dots), every map sharing the counties fetched once by URL
+compare = False
+if not client_selection and not tract_level:
+    with col1:
+        compare = st.toggle(key="compare", label="Compare SDoHs side by side")
+        if compare:
+            start = sdoh_options.index(sdoh_selection)
+            compare_sdohs = st.multiselect(key="compare_sdohs",
+                                           label="**SDoHs to compare**",
+                                           options=sdoh_options,
+                                           default=sdoh_options[start:start + 3],
+                                           max_selections=config.COMPARISON_MAX_SDOHS,
+                                           format_func=lambda x: dict_sdohLabels[x])
+            compare_labs = st.multiselect(key="compare_labs",
+                                          label="**Kidney lab tests (dots)**",
+                                          options=lab_options,
+                                          default=[lab_selection],
+                                          format_func=lambda y: dict_labLabels[y])
+            compare = bool(compare_sdohs)
+
+### Data Download ###
+# The values shown (or every lab and SDoH) of every municipio, from the query layer
+if not client_selection and not tract_level:
+    with col1:
+        with st.expander("Download data"):
+            scope = st.radio(key="download_scope",
+                             label="**Columns**",
+                             options=["selection", "all"],
+                             format_func={"selection": "Selected lab and SDoH", "all": "Every lab and SDoH"}.get)
+            download_format = st.radio(key="download_format", label="**Format**", options=["csv", "parquet"],
+                                       format_func=str.upper, horizontal=True)
+            download_columns = (lab_selection, sdoh_selection) if scope == "selection" else None
+            st.download_button(label="Download",
+                               data=export(load_store(sdoh, sdoh_version), sdoh_version, download_columns,
+                                           download_format),
+                               file_name="sdoh%s%s.%s" % ("" if year is None else "-%d" % year,
+                                                          "-".join([""] + list(download_columns or [])),
+                                                          download_format),
+                               mime=query.FORMATS[download_format])
+
+# Combined map, built once per selection pair (or once for client-side selection) and data version (year),
+# and shared by all sessions. It is built from the data frame held for the published signature, never re-read
+# from disk (a file replaced during a reload would otherwise end up under the old signature, next to the old
+# tables). The animation is built once per selection pair and set of partitions.
+with rerun.span("figure"):
+    neighbours = []     # pair maps to prefetch, (key, build)
+    if tract_level:
+        figure_key = ("tract", lab_selection, sdoh_selection, tract_data.version, tract_geometry.version)
+        build = compact(lambda: figures.build_figure(tract_data.data, tract_geometry.geojson, tract_data.tables,
+                                                     lab_selection, sdoh_selection,
+                                                     dots_data=tract_data.dots, dots_tables=tract_data.dots_tables,
+                                                     locations=tracts.TRACT_COLUMN, hover_name="NAME"))
+    elif compare:
+        geojson_url = counties_url(counties, counties.version)
+        figure_key = ("comparison", tuple(compare_labs), tuple(compare_sdohs), sdoh_version, counties.version,
+                      geojson_url)
+        build = lambda: figures.build_comparison_figure(sdoh, geojson_url or counties.geojson, tables,
+                                                        compare_sdohs, compare_labs)
+    elif animate:
+        figure_key = ("animated", lab_selection, sdoh_selection, signatures["dataset"], counties.version)
+        build = lambda: build_animated_figure(years, signatures["dataset"], counties.geojson,
+                                              lab_selection, sdoh_selection)
+    elif client_selection:
+        figure_key = ("client", sdoh_version, counties.version)
+        build = lambda: figures.build_client_figure(sdoh, counties.geojson, tables)
+    else:
+        geojson_url = counties_url(counties, counties.version)
+        figure_key = (lab_selection, sdoh_selection, sdoh_version, counties.version)
+        build = pair_builder(sdoh, counties, tables, lab_selection, sdoh_selection, geojson_url)
+        neighbours = [((lab, column, sdoh_version, counties.version),
+                       pair_builder(sdoh, counties, tables, lab, column, geojson_url))
+                      for lab, column in prefetch.neighbours(lab_selection, sdoh_selection)]
+    mapp, figure_hit = figure_cache().lookup(figure_key, build)
+
+if rerun.enabled:
+    rerun.record(lab=lab_selection, sdoh=sdoh_selection, year=year, geography="tract" if tract_level else "county",
+                 figure_cache="hit" if figure_hit else "miss",
+                 figure_bytes=figure_bytes(mapp, figure_key))
 
 
 with col2:
     # Display the plot and all its traces
-    st.plotly_chart(mapp,
-                    use_container_width=True,
-                    config={"displayModeBar":"hover",  # Sets the mode bar to appear only when the mouse is inside the plot
-                            "displaylogo":False,       # Removes the Plotly-Dash logo from appearing in the mode bar options
-                            "scrollZoom":False})
+    with rerun.span("plotly_chart"):
+        st.plotly_chart(mapp,
+                        use_container_width=True,
+                        config={"displayModeBar":"hover",  # Sets the mode bar to appear only when the mouse is inside the plot
+                                "displaylogo":False,       # Removes the Plotly-Dash logo from appearing in the mode bar options
+                                "scrollZoom":False})
+
+# The pairs likely to be picked next are built while this one is looked at (their builds are cancelled
+# when this session ends, through its handle in the session state)
+if neighbours:
+    if "prefetch" not in st.session_state:
+        st.session_state["prefetch"] = prefetcher().session()
+    prefetcher().submit(st.session_state["prefetch"], neighbours)
     
+# Every pair's correlation, the selection is not known by the server with client-side selection
+if client_selection:
+    with st.expander("Lab and SDoH correlations (Pearson r)"):
+        st.dataframe(associations["pearson"].unstack("lab").rename(index=dict_sdohLabels, columns=dict_labLabels),
+                     use_container_width=True)
+
 # if sdoh_selection:
 #     st.toast(body="Current SDOH  %s" % dict_sdohLabels[sdoh_selection], icon="⚕️") 
 # if lab_selection:
@@ -570,4 +636,13 @@ hide_style = """<style>
                  footer {visibility: hidden;}
              </style>"""
 
-st.markdown(hide_style, unsafe_allow_html=True) 
+st.markdown(hide_style, unsafe_allow_html=True)
+
+
+# Rerun's timings as a JSON log line, and in a debug panel with "?debug=1"
+rerun_record = rerun.emit()
+if debug:
+    with st.expander("Debug: rerun timings"):
+        st.json({**rerun_record, "figure_cache_stats": figure_cache().stats(),
+                 "data_cache_stats": data_cache().stats(), "bundle_cache_stats": bundle_cache().stats(),
+                 "prefetch_stats": prefetcher().stats()})
@@ -0,0 +1,4 @@
+# Kidney Disease Lab Data / Social Determinants of Health Dashboard - Puerto Rico
+#
+# Data loading, metadata and figure building, free of Streamlit and of import-time side effects.
+# The Streamlit application is a.py.
@@ -0,0 +1,189 @@
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from . import config
+
+
+# Lab x SDOH Associations
+# Pearson and Spearman correlations of every lab against every SDOH, with percentile bootstrap
+# confidence intervals (counties resampled with replacement). All pairs are computed together as
+# matrix products; pairs are only grouped by the counties they have data for (one group when every
+# lab has data for the same counties). Computed once per dataset version and cached on disk.
+#
+# With several workers, load() runs the bootstrap in its own process, the same as
+#
+#   python -m sdoh_dashboard.association values.parquet --labs ... --sdohs ... --output associations.parquet
+#
+# whose worker processes are spawned from this module: they never re-run the caller's __main__ (the Streamlit
+# page), and nothing is forked from the multi-threaded server.
+N_BOOTSTRAP = 2000
+CONFIDENCE = 0.95
+SEED = 20231
+
+# Resamples per bootstrap task, fixed so the intervals do not depend on the number of workers
+BOOTSTRAP_CHUNK = 250
+
+# sdoh.csv stores 0.0 for the municipios without lab data
+MISSING_LAB_VALUE = 0.0
+
+COLUMNS = ["n", "pearson", "pearson_low", "pearson_high", "spearman", "spearman_low", "spearman_high"]
+
+
+# Average ranks (ties share their mean rank) along axis -2 of an (..., n, k) array
+def _rank(values):
+    moved = np.moveaxis(values, -2, 0)
+    ranks = pd.DataFrame(moved.reshape(len(moved), -1)).rank(axis=0, method="average").to_numpy()
+    return np.moveaxis(ranks.reshape(moved.shape), 0, -2)
+
+
+# Pearson correlation of every column of x (..., n, a) with every column of y (..., n, b) -> (..., a, b)
+def _pearson(x, y):
+    x = x - x.mean(axis=-2, keepdims=True)
+    y = y - y.mean(axis=-2, keepdims=True)
+    covariances = np.einsum("...ni,...nj->...ij", x, y)
+    norms = (np.sqrt(np.einsum("...ni,...ni->...i", x, x))[..., :, None]
+             * np.sqrt(np.einsum("...nj,...nj->...j", y, y))[..., None, :])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return covariances / norms      # NaN when a column is constant
+
+
+def _correlations(x, y):
+    return _pearson(x, y), _pearson(_rank(x), _rank(y))
+
+
+# Correlations of n_resamples bootstrap resamples of the rows of x and y
+def _bootstrap(x, y, n_resamples, seed):
+    rows = np.random.default_rng(seed).integers(0, len(x), size=(n_resamples, len(x)))
+    return _correlations(x[rows], y[rows])
+
+
+# Percentile intervals of every pair's bootstrap correlations
+def _intervals(resamples, confidence):
+    tails = (1 - confidence) / 2 * 100
+    with np.errstate(invalid="ignore"):
+        return np.nanpercentile(resamples, [tails, 100 - tails], axis=0)
+
+
+def compute(sdoh, lab_options, sdoh_options, n_bootstrap=N_BOOTSTRAP, confidence=CONFIDENCE,
+            workers=config.BOOTSTRAP_WORKERS, seed=SEED):
+    labs = sdoh[list(lab_options)].to_numpy(dtype=float)
+    sdohs = sdoh[list(sdoh_options)].to_numpy(dtype=float)
+    lab_valid = ~np.isnan(labs) & (labs != MISSING_LAB_VALUE)
+    sdoh_valid = ~np.isnan(sdohs)
+
+    # Pairs grouped by the counties with both values
+    groups = {}
+    for i in range(len(lab_options)):
+        for j in range(len(sdoh_options)):
+            valid = lab_valid[:, i] & sdoh_valid[:, j]
+            groups.setdefault(valid.tobytes(), (valid, []))[1].append((i, j))
+
+    table = np.full((len(lab_options), len(sdoh_options), len(COLUMNS)), np.nan)
+    chunks = [min(BOOTSTRAP_CHUNK, n_bootstrap - start) for start in range(0, n_bootstrap, BOOTSTRAP_CHUNK)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+
+    with (ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+          if workers > 1 else _NoPool()) as executor:
+        for valid, pairs in groups.values():
+            lab_index = sorted({i for i, _ in pairs})
+            sdoh_index = sorted({j for _, j in pairs})
+            x, y = labs[valid][:, lab_index], sdohs[valid][:, sdoh_index]
+            pearson, spearman = _correlations(x, y)
+
+            resamples = list(executor.map(_bootstrap, [x] * len(chunks), [y] * len(chunks), chunks, seeds))
+            pearson_ci = _intervals(np.concatenate([result[0] for result in resamples]), confidence)
+            spearman_ci = _intervals(np.concatenate([result[1] for result in resamples]), confidence)
+
+            for i, j in pairs:
+                a, b = lab_index.index(i), sdoh_index.index(j)
+                table[i, j] = (valid.sum(), pearson[a, b], pearson_ci[0, a, b], pearson_ci[1, a, b],
+                               spearman[a, b], spearman_ci[0, a, b], spearman_ci[1, a, b])
+
+    index = pd.MultiIndex.from_product([lab_options, sdoh_options], names=["lab", "sdoh"])
+    frame = pd.DataFrame(table.reshape(-1, len(COLUMNS)), index=index, columns=COLUMNS)
+    return frame.astype({"n": "int64"})
+
+
+# Runs the bootstrap tasks in this process
+class _NoPool:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def map(self, function, *iterables):
+        return map(function, *iterables)
+
+
+# compute() in a `python -m sdoh_dashboard.association` process, which starts the worker processes
+def compute_in_process(sdoh, lab_options, sdoh_options, n_bootstrap=N_BOOTSTRAP, confidence=CONFIDENCE,
+                       workers=config.BOOTSTRAP_WORKERS, seed=SEED):
+    with tempfile.TemporaryDirectory(prefix="sdoh-associations-") as directory:
+        values, output = os.path.join(directory, "values.parquet"), os.path.join(directory, "associations.parquet")
+        sdoh[list(lab_options) + list(sdoh_options)].to_parquet(values, engine="pyarrow", index=False)
+        subprocess.run([sys.executable, "-m", __name__, values, "--output", output,
+                        "--labs", ",".join(lab_options), "--sdohs", ",".join(sdoh_options),
+                        "--n-bootstrap", str(n_bootstrap), "--confidence", str(confidence),
+                        "--workers", str(workers), "--seed", str(seed)],
+                       cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), check=True)
+        return pd.read_parquet(output)
+
+
+# Associations of a dataset version, read from the on-disk cache when already computed
+def load(sdoh, version, lab_options, sdoh_options, n_bootstrap=N_BOOTSTRAP, confidence=CONFIDENCE,
+         workers=config.BOOTSTRAP_WORKERS, cache_dir=config.CACHE_DIR):
+    path = os.path.join(cache_dir, "associations-%s-%d-%g.parquet" % (version[:16], n_bootstrap, confidence))
+    try:
+        table = pd.read_parquet(path)
+        if list(table.index.get_level_values("lab").unique()) == list(lab_options) and \
+                list(table.index.get_level_values("sdoh").unique()) == list(sdoh_options):
+            return table
+
+    except (OSError, ValueError):
+        pass
+
+    if workers > 1:
+        table = compute_in_process(sdoh, lab_options, sdoh_options, n_bootstrap, confidence, workers)
+    else:
+        table = compute(sdoh, lab_options, sdoh_options, n_bootstrap, confidence, workers)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        table.to_parquet(path + ".tmp", engine="pyarrow")
+        os.replace(path + ".tmp", path)
+
+    except OSError as error:
+        print("Failed to write associations cache:", error)
+
+    return table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Computes the lab x SDOH correlations with bootstrap intervals.")
+    parser.add_argument("values", help="Parquet file with the lab and SDOH columns")
+    parser.add_argument("--output", required=True, help="Parquet file written with the associations")
+    parser.add_argument("--labs", required=True, help="comma-separated lab columns")
+    parser.add_argument("--sdohs", required=True, help="comma-separated SDOH columns")
+    parser.add_argument("--n-bootstrap", type=int, default=N_BOOTSTRAP)
+    parser.add_argument("--confidence", type=float, default=CONFIDENCE)
+    parser.add_argument("--workers", type=int, default=config.BOOTSTRAP_WORKERS)
+    parser.add_argument("--seed", type=int, default=SEED)
+    args = parser.parse_args(argv)
+
+    table = compute(pd.read_parquet(args.values), args.labs.split(","), args.sdohs.split(","),
+                    args.n_bootstrap, args.confidence, args.workers, args.seed)
+    table.to_parquet(args.output, engine="pyarrow")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+import sys
+import json
+import time
+import platform
+import argparse
+import itertools
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+from . import config, dataset, figures, geometry, precompute
+from .metadata import sdoh_options, lab_options
+
+
+# Headless Render Benchmark
+# Times every phase of a render for all (lab_options x sdoh_options) pairs, offline, and writes the
+# results as JSON. A stored result can be used as a baseline, regressions beyond a threshold fail the run.
+#
+#   python -m sdoh_dashboard.benchmark --output bench.json
+#   python -m sdoh_dashboard.benchmark --baseline bench.json --threshold 0.15
+
+PHASES = ["load_data", "load_geometry", "precompute", "build_figure", "to_json"]
+
+# Compared against the baseline: phases' latencies and the payload size
+COMPARED = [(phase, statistic) for phase in PHASES for statistic in ("p50_ms", "p95_ms")] + [("payload", "p50_bytes")]
+
+
+class Timings:
+
+    def __init__(self):
+        self.samples = {phase: [] for phase in PHASES}
+
+    # Runs a phase, records its duration and returns its result
+    def run(self, phase, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.samples[phase].append(time.perf_counter() - start)
+        return result
+
+
+def _summary(samples):
+    milliseconds = np.array(samples) * 1000
+    return {"n": len(samples),
+            "p50_ms": round(float(np.percentile(milliseconds, 50)), 3),
+            "p95_ms": round(float(np.percentile(milliseconds, 95)), 3),
+            "mean_ms": round(float(milliseconds.mean()), 3),
+            "max_ms": round(float(milliseconds.max()), 3)}
+
+
+# One render of a selection pair, with the same inputs as the app (only the selection's columns are read)
+def render(timings, counties, tables, lab_selection, sdoh_selection):
+    sdoh = timings.run("load_data", dataset.read, config.MAP_COLUMNS + (lab_selection, sdoh_selection))
+    figure = timings.run("build_figure", figures.build_figure, sdoh, counties.geojson, tables, lab_selection, sdoh_selection)
+    return timings.run("to_json", figure.to_json)
+
+
+# Loads the geometry and tables, as a new server process does
+def load(timings, sources):
+    sdoh = timings.run("load_data", dataset.read, config.MAP_COLUMNS + tuple(lab_options) + tuple(sdoh_options))
+    counties = timings.run("load_geometry", geometry.load_counties, tuple(sdoh["COUNTYFIPS"]),
+                           allow_network=False, sources=sources)
+    tables = timings.run("precompute", precompute.precompute, sdoh, sdoh_options, lab_options, figures.lab_colorscale())
+    return counties, tables
+
+
+# Peak Python heap allocations (KiB) of each phase, measured in a separate pass since tracing slows it down.
+# Every pair's figure has the same size, so a few pairs are enough.
+def measure_memory(sources, pairs):
+    peaks = {}
+
+    def traced(phase, function, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            peaks[phase] = max(peaks.get(phase, 0), tracemalloc.get_traced_memory()[1] // 1024)
+            tracemalloc.stop()
+
+    timings = Timings()
+    timings.run = traced
+    counties, tables = load(timings, sources)
+    for lab_selection, sdoh_selection in pairs:
+        render(timings, counties, tables, lab_selection, sdoh_selection)
+    return peaks
+
+
+def run(sources, repeats=3, pairs=None):
+    pairs = pairs or list(itertools.product(lab_options, sdoh_options))
+
+    # Plotly's import is a one-off cost of a new process, kept out of the phases
+    start = time.perf_counter()
+    figures.lab_colorscale()
+    import plotly.express  # noqa: F401
+    import_seconds = time.perf_counter() - start
+
+    # Warm-up render, Plotly's first figure also loads its validators
+    counties, tables = load(Timings(), sources)
+    render(Timings(), counties, tables, *pairs[0])
+
+    timings = Timings()
+    payloads, per_pair = {}, {}
+    for _ in range(repeats):
+        counties, tables = load(timings, sources)
+        for lab_selection, sdoh_selection in pairs:
+            before = {phase: len(timings.samples[phase]) for phase in ("build_figure", "to_json")}
+            payload = render(timings, counties, tables, lab_selection, sdoh_selection)
+            payloads[(lab_selection, sdoh_selection)] = len(payload.encode())
+            times = per_pair.setdefault((lab_selection, sdoh_selection), {"build_figure": [], "to_json": []})
+            for phase, index in before.items():
+                times[phase].append(timings.samples[phase][index])
+
+    peaks = measure_memory(sources, pairs[:4])
+    sizes = np.array(list(payloads.values()))
+
+    return {"meta": {"timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                     "python": platform.python_version(),
+                     "platform": platform.platform(),
+                     "repeats": repeats,
+                     "pairs": len(pairs),
+                     "geometry_tolerance": counties.tolerance,
+                     "plotly_import_ms": round(import_seconds * 1000, 3)},
+            "phases": {phase: {**_summary(samples), "peak_kib": peaks.get(phase)}
+                       for phase, samples in timings.samples.items()},
+            "payload": {"p50_bytes": int(np.percentile(sizes, 50)),
+                        "max_bytes": int(sizes.max()),
+                        "total_bytes": int(sizes.sum())},
+            # ru_maxrss is in KiB on Linux
+            "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+            "pairs": [{"lab": lab_selection,
+                       "sdoh": sdoh_selection,
+                       "build_figure_ms": round(float(np.median(times["build_figure"])) * 1000, 3),
+                       "to_json_ms": round(float(np.median(times["to_json"])) * 1000, 3),
+                       "bytes": payloads[(lab_selection, sdoh_selection)]}
+                      for (lab_selection, sdoh_selection), times in per_pair.items()]}
+
+
+# Relative changes against a baseline, the ones above the threshold are regressions
+def compare(results, baseline, threshold):
+    rows = []
+    for section, statistic in COMPARED:
+        current = (results["phases"].get(section) or results.get(section, {})).get(statistic)
+        previous = (baseline["phases"].get(section) or baseline.get(section, {})).get(statistic)
+        if not current or not previous:
+            continue
+        change = current / previous - 1
+        rows.append((section, statistic, previous, current, change, change > threshold))
+    return rows
+
+
+def print_report(results):
+    print("%-14s %10s %10s %10s %10s" % ("phase", "p50 ms", "p95 ms", "max ms", "peak KiB"))
+    for phase, summary in results["phases"].items():
+        print("%-14s %10.2f %10.2f %10.2f %10s" % (phase, summary["p50_ms"], summary["p95_ms"],
+                                                   summary["max_ms"], summary["peak_kib"]))
+    print("payload: p50 %(p50_bytes)d bytes, max %(max_bytes)d bytes" % results["payload"])
+    print("peak RSS: %s KiB, plotly import: %.0f ms" % (results["peak_rss_kib"], results["meta"]["plotly_import_ms"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the dashboard's render path for every selection pair.")
+    parser.add_argument("--geojson", action="append", help="counties GeoJSON fixture (default: the bundled file)")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--pairs", type=int, help="only the first N selection pairs")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against the results stored in this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed relative slowdown (default 0.15)")
+    args = parser.parse_args(argv)
+
+    pairs = list(itertools.product(lab_options, sdoh_options))[:args.pairs]
+    results = run(tuple(args.geojson or [geometry.GEOJSON_BUNDLED]), args.repeats, pairs)
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+
+        rows = compare(results, baseline, args.threshold)
+        print("\n%-14s %-10s %12s %12s %8s" % ("section", "statistic", "baseline", "current", "change"))
+        for section, statistic, previous, current, change, regressed in rows:
+            print("%-14s %-10s %12.2f %12.2f %+7.1f%%%s" % (section, statistic, previous, current, change * 100,
+                                                          "  REGRESSION" if regressed else ""))
+        if any(row[-1] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+import os
+import sys
+import json
+import glob
+import time
+import hashlib
+import argparse
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from . import config, dataset, figures, geometry, metadata, precompute
+
+
+# Precompiled Asset Bundle
+# One file with everything a server process needs to draw the current dataset's maps: the typed dataset
+# (map, lab and SDOH columns), the pruned and simplified counties, the precomputed color tables and the
+# label metadata. It is built by a CLI, named after its content hash, and memory-mapped by the app (an
+# uncompressed Arrow IPC file): the numeric columns are read-only views of the mapped pages, nothing is
+# parsed, and every server process on the machine shares the pages through the OS cache. The content
+# hash is the version of everything derived from the bundle (tables, correlations, figures).
+#
+#   python -m sdoh_dashboard.bundle
+#   python -m sdoh_dashboard.bundle --info
+#
+# "current" in the bundle directory names the bundle in use, and is replaced atomically by a new build.
+# A bundle is ignored (the app reads the dataset and geometry instead) when the files it was built from,
+# the map's level of detail or the labels changed since.
+FORMAT = 3                  # 2: color bins of tied values fixed (precompute.py), 3: collapsed rings (simplify.py)
+METADATA_KEY = b"sdoh_bundle"
+POINTER = "current"
+COLUMNS = config.MAP_COLUMNS + tuple(metadata.lab_options) + tuple(metadata.sdoh_options)
+
+
+class Bundle(NamedTuple):
+    version: str                    # content hash of the file
+    path: str
+    data: pd.DataFrame              # COLUMNS, numeric columns backed by the mapped file
+    counties: geometry.Counties     # its version is the bundle's
+    tables: precompute.Tables
+    labels: dict                    # options, labels, descriptions and ticks of metadata.py
+
+
+# Label metadata stored in the bundle, a bundle built with other labels is out of date
+def labels():
+    return {"sdoh_options": list(metadata.sdoh_options),
+            "lab_options": list(metadata.lab_options),
+            "dict_Labels": metadata.dict_Labels,
+            "dict_sdohDescriptions": metadata.dict_sdohDescriptions,
+            "dict_labsDticks": metadata.dict_labsDticks}
+
+
+# What a bundle depends on besides its content: the source files and the map's level of detail
+def sources(geojson_sources=geometry.GEOJSON_SOURCES):
+    return json.loads(json.dumps({"dataset": dataset.signature()[:1],
+                                  "geometry": geometry.signature(geojson_sources),
+                                  "detail": config.MAP_DETAIL,
+                                  "vertices": config.MAP_VERTICES}))
+
+
+def _arrow_column(values):
+    import pyarrow as pa
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return pa.DictionaryArray.from_arrays(values.cat.codes.to_numpy(), pa.array(values.cat.categories.astype(str)))
+    if values.dtype == object:
+        return pa.array(values.astype(str).to_numpy(), type=pa.string())
+    return pa.array(values.to_numpy(), from_pandas=False)    # NaN stays a value, not a null
+
+
+# Numeric columns are views of the mapped file, strings and categories are converted
+def _pandas_column(column):
+    import pyarrow as pa
+    if pa.types.is_dictionary(column.type):
+        return column.to_pandas()
+    return column.combine_chunks().to_numpy(zero_copy_only=not pa.types.is_string(column.type))
+
+
+# Builds a bundle of the current dataset and geometry into directory, makes it the current one and removes the
+# others. Returns its path.
+def build(directory=config.BUNDLE_DIR, geojson_sources=geometry.GEOJSON_SOURCES):
+    import pyarrow as pa
+
+    data = dataset.read(COLUMNS)
+    counties = geometry.load_counties(tuple(data["COUNTYFIPS"]), allow_network=False, sources=geojson_sources)
+    tables = precompute.precompute(data, metadata.sdoh_options, metadata.lab_options, figures.lab_colorscale())
+
+    frame = pd.concat([data.reset_index(drop=True), tables.colors.reset_index(drop=True)], axis=1)
+    info = {"format": FORMAT,
+            "sources": sources(geojson_sources),
+            "labels": labels(),
+            "geometry": counties.geojson,
+            "tolerance": counties.tolerance,
+            "ticktexts": {column: values.tolist() for column, values in tables.ticktexts.items()},
+            "ranges": {column: [float(low), float(high)] for column, (low, high) in tables.ranges.items()},
+            "edges": {"index": tables.edges.index.tolist(), "columns": tables.edges.columns.tolist(),
+                      "values": tables.edges.to_numpy().tolist()}}
+
+    table = pa.Table.from_arrays([_arrow_column(frame[column]) for column in frame.columns],
+                                 names=list(frame.columns))
+    table = table.replace_schema_metadata({METADATA_KEY: json.dumps(info, separators=(",", ":"))})
+
+    os.makedirs(directory, exist_ok=True)
+    temporary = os.path.join(directory, "bundle.tmp")
+    with pa.OSFile(temporary, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    with open(temporary, "rb") as file:
+        digest = hashlib.sha1(file.read()).hexdigest()
+    path = os.path.join(directory, "sdoh-%s.arrow" % digest[:16])
+    os.replace(temporary, path)
+
+    with open(os.path.join(directory, POINTER + ".tmp"), "w", encoding="utf-8") as file:
+        file.write(os.path.basename(path))
+    os.replace(os.path.join(directory, POINTER + ".tmp"), os.path.join(directory, POINTER))
+
+    # Processes still mapping a removed bundle keep reading it until they switch
+    for old in glob.glob(os.path.join(directory, "sdoh-*.arrow")):
+        if old != path:
+            os.remove(old)
+    return path
+
+
+# Path of the current bundle, None when none was built
+def current(directory=config.BUNDLE_DIR):
+    try:
+        with open(os.path.join(directory, POINTER), encoding="utf-8") as file:
+            path = os.path.join(directory, file.read().strip())
+
+    except OSError:
+        return None
+
+    return path if os.path.exists(path) else None
+
+
+# (path, mtime, size) of the current bundle, empty without one
+def signature(directory=config.BUNDLE_DIR):
+    path = current(directory)
+    return geometry.signature((path,)) if path else ()
+
+
+# Memory-maps a bundle. Returns None, with the reason printed, when it is out of date.
+def load(path, geojson_sources=geometry.GEOJSON_SOURCES):
+    import pyarrow as pa
+
+    table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    info = json.loads(table.schema.metadata[METADATA_KEY])
+    stale = [name for name, value in (("format", info["format"] == FORMAT),
+                                      ("sources", info["sources"] == sources(geojson_sources)),
+                                      ("labels", info["labels"] == json.loads(json.dumps(labels()))))
+             if not value]
+    if stale:
+        print("Ignoring %s, out of date (%s): rebuild it with python -m sdoh_dashboard.bundle"
+              % (path, ", ".join(stale)))
+        return None
+
+    version = os.path.basename(path)[len("sdoh-"):-len(".arrow")]
+    columns = {name: _pandas_column(table.column(name)) for name in table.column_names}
+    colors = {name: values for name, values in columns.items() if name.startswith("color_")}
+
+    edges = info["edges"]
+    tables = precompute.Tables(colors=pd.DataFrame(colors, copy=False),
+                               ticktexts={column: np.array(values) for column, values in info["ticktexts"].items()},
+                               ranges={column: tuple(values) for column, values in info["ranges"].items()},
+                               edges=pd.DataFrame(edges["values"], index=edges["index"], columns=edges["columns"]))
+
+    return Bundle(version=version,
+                  path=path,
+                  data=pd.DataFrame({name: values for name, values in columns.items() if name not in colors}, copy=False),
+                  counties=geometry.Counties(geojson=info["geometry"], tolerance=info["tolerance"], version=version),
+                  tables=tables,
+                  labels=info["labels"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Builds the memory-mapped asset bundle loaded by the app.")
+    parser.add_argument("--dir", default=config.BUNDLE_DIR, help="bundle directory (default %(default)s)")
+    parser.add_argument("--geojson", action="append", help="counties GeoJSON (default: the usual sources)")
+    parser.add_argument("--info", action="store_true", help="describe the current bundle instead of building one")
+    args = parser.parse_args(argv)
+    geojson_sources = tuple(args.geojson or geometry.GEOJSON_SOURCES)
+
+    if not args.info:
+        start = time.perf_counter()
+        path = build(args.dir, geojson_sources)
+        print("Wrote %s: %d bytes (%.0f ms)" % (path, os.path.getsize(path), (time.perf_counter() - start) * 1000))
+
+    path = current(args.dir)
+    if path is None:
+        print("No bundle in %s" % args.dir)
+        return 1
+
+    start = time.perf_counter()
+    assets = load(path, geojson_sources)
+    if assets is None:
+        return 1
+    print("%s: version %s, %d rows x %d columns, %d counties, opened in %.1f ms"
+          % (path, assets.version, len(assets.data), len(assets.data.columns),
+             len(assets.counties.geojson["features"]), (time.perf_counter() - start) * 1000))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
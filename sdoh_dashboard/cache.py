@@ -0,0 +1,103 @@
+import threading
+from collections import OrderedDict
+
+
+# Process-wide cache bounded in size with least-recently-used eviction, shared by every session (cached values
+# must not be mutated). A value is built once: a lookup of a key being built (by another session or the
+# prefetch) waits for that build. Counters of hits, misses, evictions and prefetched builds are kept per cache.
+class LRUCache:
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.prefetched = 0
+        self._values = OrderedDict()
+        self._building = {}     # key -> Event set once its build is over
+        self._lock = threading.Lock()
+
+    # Returns the cached value for the key, building it (outside the lock) and storing it on a miss
+    def get_or_build(self, key, build):
+        return self.lookup(key, build)[0]
+
+    # Same as get_or_build, also telling whether the value was already cached (or being built)
+    def lookup(self, key, build):
+        while True:
+            with self._lock:
+                if key in self._values:
+                    self.hits += 1
+                    self._values.move_to_end(key)
+                    return self._values[key], True
+                building = self._building.get(key)
+                if building is None:
+                    self.misses += 1
+                    building = self._building[key] = threading.Event()
+                    break
+            # Counted as a hit when that build succeeds, else built here
+            building.wait()
+
+        return self._build(key, build, building), False
+
+    # Builds and stores a value that is neither cached nor being built, as long as the cache has room for it
+    # (it never evicts a value). Returns whether it was built, not counted as a hit or miss.
+    def prefetch(self, key, build):
+        with self._lock:
+            if key in self._values or key in self._building or len(self._values) >= self.maxsize:
+                return False
+            building = self._building[key] = threading.Event()
+
+        self._build(key, build, building)
+        with self._lock:
+            self.prefetched += 1
+        return True
+
+    def _build(self, key, build, building):
+        try:
+            value = build()
+
+            with self._lock:
+                # A value discarded meanwhile (hot reload) is stored anyway, its key is never looked up again
+                value = self._values.setdefault(key, value)
+                self._values.move_to_end(key)
+                while len(self._values) > self.maxsize:
+                    self._values.popitem(last=False)
+                    self.evictions += 1
+            return value
+
+        finally:
+            with self._lock:
+                del self._building[key]
+            building.set()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._values
+
+    def __len__(self):
+        return len(self._values)
+
+    def keys(self):
+        with self._lock:
+            return list(self._values)
+
+    # Drops the values whose key matches, returns how many
+    def discard(self, predicate):
+        with self._lock:
+            keys = [key for key in self._values if predicate(key)]
+            for key in keys:
+                del self._values[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "prefetched": self.prefetched,
+                    "size": len(self._values),
+                    "maxsize": self.maxsize}
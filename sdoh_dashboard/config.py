@@ -0,0 +1,68 @@
+import os
+
+
+# Settings, read from the environment
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.environ.get("SDOH_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "sdoh-dashboard"))
+
+# Download the counties GeoJSON when it is not bundled nor cached
+ALLOW_NETWORK = os.environ.get("SDOH_ALLOW_NETWORK", "0").lower() in ("1", "true", "yes")
+
+# Local counties GeoJSON (e.g. a test fixture) read instead of the bundled and cached ones
+GEOJSON_PATH = os.environ.get("SDOH_GEOJSON")
+
+# Map's Level of Detail: "auto" (half a pixel at the map's height), "full", or a tolerance in degrees.
+# SDOH_MAP_VERTICES sets a vertex budget for the whole map instead.
+MAP_DETAIL = os.environ.get("SDOH_MAP_DETAIL", "auto")
+MAP_VERTICES = os.environ.get("SDOH_MAP_VERTICES")
+
+# Precompiled asset bundle (python -m sdoh_dashboard.bundle), memory-mapped by the app when built
+BUNDLE_DIR = os.environ.get("SDOH_BUNDLE_DIR", os.path.join(BASE_DIR, "bundle"))
+
+# Geometry published for the maps to fetch by URL, served by Streamlit's static file serving
+# (server.enableStaticServing in .streamlit/config.toml) from the "static" folder next to a.py
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+STATIC_URL = "app/static"
+
+# Pair maps sent as compact figures: typed arrays, one customdata block, the published counties' URL
+# (see figures.compact_figure)
+COMPACT_FIGURES = os.environ.get("SDOH_COMPACT_FIGURES", "1").lower() in ("1", "true", "yes")
+# Their values go out as typed arrays from this Streamlit release on (its plotly.js decodes them), as number lists before
+TYPED_ARRAYS_STREAMLIT = (1, 45)
+
+# Maps of the comparison grid: SDOHs x labs
+COMPARISON_MAX_SDOHS = 6
+
+# Seconds between two checks of the data files for changes (hot reload), 0: checked on every rerun instead
+RELOAD_INTERVAL = float(os.environ.get("SDOH_RELOAD_INTERVAL", "2"))
+
+# Local HTTP endpoint of the query layer (sdoh_dashboard/query.py) started by the app, 0: not started
+QUERY_PORT = int(os.environ.get("SDOH_QUERY_PORT", "0"))
+QUERY_HOST = os.environ.get("SDOH_QUERY_HOST", "127.0.0.1")
+
+# Maximum number of figures held in memory (there are 4 x 22 = 88 selection pairs)
+FIGURE_CACHE_SIZE = int(os.environ.get("SDOH_FIGURE_CACHE_SIZE", "128"))
+
+# Background threads prebuilding the maps of the pairs likely to be picked next (0: off), and how many SDOHs
+# above and below the current one in the menu they cover (see sdoh_dashboard/prefetch.py)
+PREFETCH_WORKERS = int(os.environ.get("SDOH_PREFETCH_WORKERS", "1"))
+PREFETCH_DISTANCE = int(os.environ.get("SDOH_PREFETCH_DISTANCE", "2"))
+
+# "server": the lab and SDOH selectboxes rerun the app, "client": the map's own menus switch them in the browser
+# (the "?selection=client" query parameter also selects it)
+SELECTION_MODE = os.environ.get("SDOH_SELECTION_MODE", "server")
+
+# Geography level shown first when the census tract data is available: "county" or "tract"
+GEOGRAPHY = os.environ.get("SDOH_GEOGRAPHY", "county")
+
+# Per-rerun timing spans, written as JSON log lines (the "?debug=1" query parameter also shows them)
+INSTRUMENT = os.environ.get("SDOH_INSTRUMENT", "0").lower() in ("1", "true", "yes")
+
+# Worker processes of the lab x SDOH bootstrap, run once per dataset version (1: in the server process)
+BOOTSTRAP_WORKERS = int(os.environ.get("SDOH_BOOTSTRAP_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Columns used by the map besides the selected lab and SDOH
+MAP_COLUMNS = ("COUNTYFIPS", "COUNTY", "lat", "lon")
+
+MAP_HEIGHT = 650
+MAP_PROJECTION_SCALE = 172
@@ -0,0 +1,161 @@
+import os
+import re
+import sys
+import time
+import hashlib
+import argparse
+
+import pandas as pd
+
+from . import config
+
+
+# SDOHs and Labs Dataset
+# sdoh.csv is converted once into a typed, columnar Parquet file (sdoh.parquet), which is read
+# column by column. The CSV is only parsed when the Parquet file has not been built.
+CSV_PATH = os.path.join(config.BASE_DIR, "sdoh.csv")
+PARQUET_PATH = os.path.join(config.BASE_DIR, "sdoh.parquet")
+
+# Yearly releases: one Parquet partition per YEAR, each read only when that year is shown
+YEARS_DIR = os.path.join(config.BASE_DIR, "sdoh_years")
+PARTITION_NAME = re.compile(r"sdoh-(\d{4})\.parquet$")
+
+# Explicit schema, every other column is a float32 measure
+SCHEMA = {"YEAR": "int16",
+          "COUNTYFIPS": "str",
+          "TRACTFIPS": "str",
+          "STATEFIPS": "str",
+          "COUNTY": "category",
+          "STATE": "category"}
+MEASURE_DTYPE = "float32"
+
+
+# Offline-computed "color_*" helper columns are derived by precompute instead, and never stored
+def _is_stored(column):
+    return not column.startswith("color_")
+
+
+# Applies the schema to a DataFrame read from the CSV
+def apply_schema(frame):
+    return frame.astype({column: SCHEMA.get(column, MEASURE_DTYPE) for column in frame.columns})
+
+
+def read_csv(path=CSV_PATH, columns=None):
+    usecols = (lambda column: _is_stored(column)) if columns is None else list(columns)
+    frame = pd.read_csv(path, dtype={"COUNTYFIPS":str, "STATEFIPS":str, "TRACTFIPS":str}, low_memory=False,
+                        usecols=usecols)
+    if columns is not None:
+        frame = frame[list(columns)]
+    return apply_schema(frame)
+
+
+def read_parquet(path=PARQUET_PATH, columns=None):
+    return pd.read_parquet(path, columns=None if columns is None else list(columns))
+
+
+def partition_path(year, years_dir=YEARS_DIR):
+    return os.path.join(years_dir, "sdoh-%d.parquet" % year)
+
+
+# Years with a partition, from the file names only (no data is read)
+def years(years_dir=YEARS_DIR):
+    try:
+        names = os.listdir(years_dir)
+
+    except OSError:
+        return []
+
+    return sorted(int(match.group(1)) for match in map(PARTITION_NAME.match, names) if match)
+
+
+# Reads only the given columns (all when None) of a year's partition, or of the current dataset when year
+# is None: from the Parquet file when it exists, else from the CSV
+def read(columns=None, year=None, parquet_path=PARQUET_PATH, csv_path=CSV_PATH, years_dir=YEARS_DIR):
+    if year is not None:
+        return read_parquet(partition_path(year, years_dir), columns)
+    if os.path.exists(parquet_path):
+        return read_parquet(parquet_path, columns)
+    return read_csv(csv_path, columns)
+
+
+# (path, mtime, size) of the file read() would use, followed by those of the year partitions. Changes
+# whenever the dataset is rebuilt or replaced, or a partition is added.
+def signature(parquet_path=PARQUET_PATH, csv_path=CSV_PATH, years_dir=YEARS_DIR):
+    paths = [parquet_path if os.path.exists(parquet_path) else csv_path]
+    paths += [partition_path(year, years_dir) for year in years(years_dir)]
+    return tuple((path, stat.st_mtime_ns, stat.st_size) for path, stat in ((path, os.stat(path)) for path in paths))
+
+
+# Years of the partitions in a signature
+def signature_years(signature):
+    return sorted(int(match.group(1)) for match in (PARTITION_NAME.search(path) for path, _, _ in signature) if match)
+
+
+# Content hash of a DataFrame, part of the cache keys of everything derived from it
+def version(frame):
+    return hashlib.sha1(pd.util.hash_pandas_object(frame).values.tobytes()).hexdigest()
+
+
+# Build step: sdoh.csv -> sdoh.parquet
+def build(csv_path=CSV_PATH, parquet_path=PARQUET_PATH):
+    frame = read_csv(csv_path)
+    frame.to_parquet(parquet_path + ".tmp", engine="pyarrow", index=False, compression="zstd")
+    os.replace(parquet_path + ".tmp", parquet_path)
+    return frame
+
+
+# Build step: one partition per YEAR of the given CSVs (a year found in several CSVs keeps the last one)
+def build_partitions(csv_paths, years_dir=YEARS_DIR):
+    os.makedirs(years_dir, exist_ok=True)
+    written = []
+    for csv_path in csv_paths:
+        for year, frame in read_csv(csv_path).groupby("YEAR", sort=True):
+            path = partition_path(int(year), years_dir)
+            frame.reset_index(drop=True).to_parquet(path + ".tmp", engine="pyarrow", index=False, compression="zstd")
+            os.replace(path + ".tmp", path)
+            written.append(int(year))
+    return sorted(set(written))
+
+
+# Parse time (best of repeats) and in-memory size of a reader
+def measure(read_frame, repeats=20):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        frame = read_frame()
+        timings.append(time.perf_counter() - start)
+    return min(timings), int(frame.memory_usage(deep=True).sum())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Converts sdoh.csv into the columnar sdoh.parquet dataset.")
+    parser.add_argument("--csv", default=CSV_PATH)
+    parser.add_argument("--parquet", default=PARQUET_PATH)
+    parser.add_argument("--compare", action="store_true", help="measure parse time and memory of both formats")
+    parser.add_argument("--partition", action="store_true", help="also write one partition per YEAR in sdoh_years/")
+    parser.add_argument("--release", action="append", default=[],
+                        help="CSV of another yearly release to partition, with the same columns as sdoh.csv")
+    parser.add_argument("--years-dir", default=YEARS_DIR)
+    args = parser.parse_args(argv)
+
+    frame = build(args.csv, args.parquet)
+    print("Wrote %s: %d rows, %d columns, %d bytes"
+          % (args.parquet, len(frame), len(frame.columns), os.path.getsize(args.parquet)))
+
+    if args.partition or args.release:
+        written = build_partitions(args.release + [args.csv], args.years_dir)
+        print("Wrote %d year partitions in %s: %s" % (len(written), args.years_dir, ", ".join(map(str, written))))
+
+    if args.compare:
+        selection = ["COUNTYFIPS", "COUNTY", "lat", "lon", "albumin_urine", "ACS_PCT_INC50_ABOVE65"]
+        readers = {"csv (original)": lambda: pd.read_csv(args.csv, dtype={"COUNTYFIPS":str, "STATEFIPS":str},
+                                                         low_memory=False),
+                   "parquet (all columns)": lambda: read_parquet(args.parquet),
+                   "parquet (one selection)": lambda: read_parquet(args.parquet, selection)}
+        for name, read_frame in readers.items():
+            seconds, size = measure(read_frame)
+            print("%-24s %8.2f ms %10d bytes in memory" % (name, seconds * 1000, size))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
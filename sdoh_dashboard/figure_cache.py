@@ -0,0 +1,9 @@
+from .cache import LRUCache
+
+
+# Process-wide cache of built figures, bounded in size with least-recently-used eviction.
+# Keys are (lab_selection, sdoh_selection, data version), so a new dataset or geometry never
+# serves a stale figure. Cached figures are shared by every session and must not be mutated.
+# A figure is built once: a lookup of a figure being built (by another session or the prefetch) waits for it.
+class FigureCache(LRUCache):
+    pass
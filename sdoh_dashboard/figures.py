@@ -0,0 +1,507 @@
+import numpy as np
+import pandas as pd
+
+from . import config
+from .metadata import (sdoh_options, lab_options, dict_Labels, dict_labLabels, dict_sdohLabels, dict_sdohDescriptions,
+                       dict_labsDticks)
+from .precompute import SDOH_TICKVALS, SDOH_COLOR_LEVELS, MISSING_LAB_COLOR
+
+
+# Figure Creation
+# Plotly is only imported when a figure is first built
+
+# Colorscale of the lab dots, sampled by precompute for the dots' colors
+def lab_colorscale():
+    import plotly.express.colors as pc
+    return pc.sequential.Oranges
+
+
+# Puerto Rico Choropleth Map (SDOH) combined with the Scattergeo Map (Lab) for a selection pair.
+# The dots default to the choropleth's data and tables, the tract level draws them from the county data.
+def build_figure(sdoh, counties, tables, lab_selection, sdoh_selection, dots_data=None, dots_tables=None,
+                 locations="COUNTYFIPS", hover_name="COUNTY"):
+    import plotly.express as px
+    import plotly.express.colors as pc
+
+    dots_data = sdoh if dots_data is None else dots_data
+    dots_tables = tables if dots_tables is None else dots_tables
+
+    # Ticks information, precomputed for every SDOH
+    sdoh_ticktexts = tables.ticktexts[sdoh_selection]
+
+
+    ### Puerto Rico Choropleth Map containing Counties with SDOH Data ###
+    mapp = px.choropleth(data_frame=sdoh,                                        # dataframe to use
+                         geojson=counties,                                       # establishes coordinates of Puerto Rico to trace its map
+                         locations=locations,                                    # determines considered locations, used for plot traces and updates
+                         labels=dict_Labels,                                     # labels for labs and sdohs
+                         hover_name=hover_name,                                  # counties names
+                         # hover_data={sdoh_selection:True, "COUNTYFIPS":False}, # info contained in counties
+                         hover_data={lab_selection:":.1f", sdoh_selection:":.0f",
+                                     locations:False},
+                         # color=dict_sdohColors[sdoh_selection],                # counties color intensities
+                         # color_continuous_scale=pc.sequential.Purples,         # color scale for color intensities
+                         # range_color=[0.35, 1],                                # min and max color intensities for counties
+                         )      
+
+    # Geographical Map Design
+    mapp.update_geos(scope="world",                         # sets section of world map
+                     fitbounds=False,                       # removes mapping of locations with geojson coordinates, same as <fitbounds> in px.choropleth(...)
+                     visible=False,                         # removes all other countries and continents, same as <basemap_visible> in px.choropleth(...)
+                     center=dict(lat=18.155, lon=-66.245),  # sets center coordinates of the figure's map projection
+                     bgcolor="#f5f5f5",                     # background color name: "whitesmoke"
+                     projection_scale=config.MAP_PROJECTION_SCALE, # sets the map's initial zoom and projection type
+                     # showframe=True,                       # shows the border lines of the map's plot box
+                     )
+
+    # Map's Figure Layout
+    mapp.update_layout(autosize=False,                                      # allows custom size
+                       margin=dict(autoexpand=True, r=0, t=0, l=0, b=0),    # figure's boundaries, distance from the plot's borders to the container's borders
+
+                       # width=1425,                                          # map horizontal size/length, same as <width> in px.choropleth(...)
+                       # height=712.5,                                          # map vertical size/length, same as <height> in px.choropleth(...)
+                       # width=1375,
+                       # height=687.5,
+                       # width=1100,
+                       height=config.MAP_HEIGHT,
+
+                       paper_bgcolor="#f5f5f5",                             # application background color
+                       # paper_bgcolor="indigo",
+
+                       dragmode=False,                                      # disables dragging of the map figure
+                       modebar=dict(color="#303030", 
+                                    activecolor="#d303fc", 
+                                    bgcolor="#f5f5f5",
+                                    remove=["zoomIn", "zoomOut", "select",  # disables modebar's options 
+                                            "lasso", "pan", "reset"]),
+
+                       # title=dict(                       # Main Title Design
+                       #     automargin=True,              
+                       #     pad=dict(t=0, l=0, b=0, r=0),  
+                       #     x=0.50,                        
+                       #     y=0.90, 
+                       #     xref="paper", 
+                       #     yref="paper", 
+                       #     xanchor="center",
+                       #     yanchor="top",
+                       #     text="Puerto Rico<br>", 
+                       #     "SDOHs-Kidney Disease",       
+                       #     font=dict(color="purple", family="Rockwell", size=16)), 
+
+
+                       showlegend=False,
+                       # legend=dict(                       # Legend Design 
+                       #    x=0.60, 
+                       #    y=-0.175,
+
+                       #    bgcolor="#f5f5f5",              # legend background color
+                       #    bordercolor="black",            # legend border lines color
+                       #    borderwidth=0.75,               # legend border lines thickness 
+                       #    
+                       #    entrywidth=1,                   # space between symbols and labels
+                       #    entrywidthmode="pixels",        # determines unit of measurement
+                       #    itemwidth=30,                   # size of symbols inside the legend
+                       #    traceorder="reversed",
+                       #    
+                       #    title=dict(side="top",                                  # legend's title text properties
+                       #               text="Legend",                   
+                       #               font=dict(color="black", family="Rockwell", size=14)))
+                       #    font=dict(color="black", family="Rockwell", size=13),   # legend's labels text properties
+                       )
+
+    # Map's Traces Properties
+    mapp.update_traces(visible=True,
+                       name=dict_sdohLabels[sdoh_selection],                # new name of symbol
+                       z=tables.colors["color_"+sdoh_selection],
+                       # z=sdoh[dict_sdohColors[sdoh_selection]],
+                       # z=sdoh[sdoh_selection],
+                       # zauto=False,                                       # allows custom inferior/superior limits & midpoint
+                       # zmin=sdoh[sdoh_selection].min(),
+                       # zmax=sdoh[sdoh_selection].max(),     
+
+                       marker=dict(line=dict(color="#303030",
+                                             width=1.5 if locations == "COUNTYFIPS" else 0.4),  # thinner tract borders
+                                   opacity=0.925),
+
+                       showscale=True,
+                       autocolorscale=False,
+                       colorscale=pc.sequential.Purples,
+                       reversescale=False,
+
+
+                       showlegend=False,                     # allows to be shown in the legend
+                       legendrank=1,                         # first symbol in the legend
+                       legendwidth=10,                       # width of legend box
+
+                       colorbar=dict(
+                           orientation="h",                  # sets the colorscale bar to be drawn horizontaly
+                           outlinecolor="black",             # sets the color of the bar's borders
+                           outlinewidth=1.05,                # sets thickness of the borders' lines
+
+                           x=0.72,
+                           y=0.025,                    
+
+                           thickness=13,                     # thickness size of the bar
+                           len=0.40,                         # length of the bar                       
+
+                           title=dict(
+                               side="bottom",
+                               text=dict_sdohLabels[sdoh_selection],
+                               font=dict(color="#303030", family="Rockwell", size=11)),   
+
+                           tickmode="array",
+                           tickvals=SDOH_TICKVALS,
+                           ticktext=sdoh_ticktexts,
+                           # tickformat=".0f",
+                           # ticksuffix="%",
+                           ticks="inside",
+                           tickwidth=1.35,
+                           ticklen=3.5,
+                           tickcolor="black",
+                           tickfont=dict(color="#303030", family="Rockwell", size=10))
+                      )
+
+
+
+
+    # Puerto Rico Scattergeo Map containing County Coordinate with Lab Data
+    # Counties without lab data: Añasco, Florida, Hormigueros, Las Marías, and Orocovis
+    dots = px.scatter_geo(data_frame=dots_data,
+                          lat="lat",
+                          lon="lon",
+                          fitbounds="locations",
+                          labels=dict_Labels,                                          # labels for labs and sdohs
+                          hover_name="COUNTY",                                         # title of the dots' hoverboxes
+                          hover_data={lab_selection:":.1f", sdoh_selection:":.0f",     # information contained inside dots
+                                      "lat":False, "lon":False}
+                          # color="creatinine_serum",                                  # dots color intensities
+                          # color_continuous_scale=pc.sequential.Oranges,              # color scale for color intensities
+                          # range_color=[0.30, 1.0],                                   # min and max color intensities for dots 
+                          # opacity=0.75,                                              # transparency level for dots 
+                          )
+
+    # Dot's Figure Layout
+    dots.update_layout(margin=dict(r=0, t=0, l=0, b=0),
+                       autosize=False,                   # allows custom size                   
+                       showlegend=False)                        
+
+    # Map's Traces Properties 
+    dots.update_traces(showlegend=False,                                      # allows to be shown in the legend
+                       legendrank=2,                                          # second symbol in the legend
+                       name=dict_labLabels[lab_selection],                    # sets the trace name in the legend and on datum hover 
+
+                       hoverlabel=dict(align="left",                          # sets text to be aligned to the left
+                                       # bgcolor="darkorange",                # hoverbox background color
+                                       bordercolor="black"),                  # hoverbox edges color
+
+                       # selected_marker=dict(opacity=1, size=10),
+                       marker=dict(
+                           size=9,                                            # size of dots, same as <size> in px.scatter_geo(...)
+                           line=dict(width=1.25, color="#303030"),            # dots borders line thickness & color
+
+                           color=dots_tables.colors["color_"+lab_selection],  # determines color intensities
+                           # color=sdoh[dict_labColors[lab_selection]],
+                           opacity=0.90,
+                           cauto=False,                                       # allows custom inferior/superior limits & midpoint
+                           cmin=dots_tables.ranges[lab_selection][0],
+                           cmax=dots_tables.ranges[lab_selection][1],
+
+                           showscale=True,                                    # displays scale values-to-color-intensities
+                           autocolorscale=False,                              # allows custom colorscale
+                           colorscale="Oranges",                              # determines color scale for color intensities
+                           reversescale=False,                                # reverses bright and dark values
+
+                           colorbar=dict(
+                               orientation="h",                               # sets the colorscale bar to be drawn horizontaly
+                               outlinecolor="black",                          # sets the color of the bar's borders
+                               outlinewidth=1.05,                             # sets thickness of the borders' lines
+
+                               x=0.28,
+                               y=0.025,                      
+
+                               thickness=13,                                   # thickness size of the bar
+                               len=0.40,                                       # length of the bar
+
+                               title=dict(
+                                   side="bottom",
+                                   text=dict_labLabels[lab_selection],
+                                   font=dict(color="#303030", family="Rockwell", size=11)), 
+
+                               tickmode="linear",
+                               tick0=0,
+                               dtick=dict_labsDticks[lab_selection],
+                               # tickformat=".1f",
+                               ticks="inside",
+                               tickwidth=1.30,
+                               ticklen=4,
+                               tickcolor="black",
+                               tickfont=dict(color="#303030", family="Rockwell", size=10)))          
+                       )
+
+
+
+    # Combines the Dots Traces of the Scattergeo Map with the Counties Traces of the Choropleth Map, 
+    # based on Puerto Rico's Coordinates.
+    mapp.append_trace(dots.data[0], row="all", col="all")
+
+    return mapp
+
+
+# Hover values as text, missing values are left blank
+def _hover_values(values, decimals):
+    return ["" if value != value else "%.*f" % (decimals, value) for value in values]
+
+
+# Client-side Selection Figure
+# Carries the color arrays, ticks and hover values of every lab and SDOH once. The selection is made with
+# the map's own dropdown menus, which restyle the traces in the browser (no rerun, no geometry resend).
+# The lab fills the hover's "text" and "meta[0]", the SDOH its "customdata" and "meta[1]", so each menu
+# only touches its own half of the hover.
+CLIENT_HOVERTEMPLATE = "<b>%{hovertext}</b><br><br>%{meta[0]}=%{text}<br>%{meta[1]}=%{customdata}<extra></extra>"
+
+
+def build_client_figure(sdoh, counties, tables):
+    lab_selection, sdoh_selection = lab_options[0], sdoh_options[0]
+    mapp = build_figure(sdoh, counties, tables, lab_selection, sdoh_selection)
+
+    lab_texts = {lab: _hover_values(sdoh[lab], 1) for lab in lab_options}
+    sdoh_texts = {column: _hover_values(sdoh[column], 0) for column in sdoh_options}
+
+    mapp.update_traces(hovertemplate=CLIENT_HOVERTEMPLATE,
+                       meta=[dict_labLabels[lab_selection], dict_sdohLabels[sdoh_selection]],
+                       text=lab_texts[lab_selection],
+                       customdata=sdoh_texts[sdoh_selection])
+
+    # Restyles apply to both traces [choropleth, dots], attributes a trace does not have are ignored by it
+    lab_buttons = [dict(label=dict_labLabels[lab],
+                        method="restyle",
+                        args=[{"text": [lab_texts[lab]] * 2,
+                               "meta[0]": [dict_labLabels[lab]] * 2,
+                               "marker.color": [list(tables.colors["color_"+lab])] * 2,
+                               "marker.cmin": [tables.ranges[lab][0]] * 2,
+                               "marker.cmax": [tables.ranges[lab][1]] * 2,
+                               "marker.colorbar.title.text": [dict_labLabels[lab]] * 2,
+                               "marker.colorbar.dtick": [dict_labsDticks[lab]] * 2},
+                              [0, 1]])
+                   for lab in lab_options]
+
+    sdoh_buttons = [dict(label=dict_sdohLabels[column],
+                         method="update",
+                         args=[{"customdata": [sdoh_texts[column]] * 2,
+                                "meta[1]": [dict_sdohLabels[column]] * 2,
+                                "z": [list(tables.colors["color_"+column])] * 2,
+                                "colorbar.ticktext": [list(tables.ticktexts[column])] * 2,
+                                "colorbar.title.text": [dict_sdohLabels[column]] * 2},
+                               {"annotations[0].text": dict_sdohDescriptions[column]},
+                               [0, 1]])
+                    for column in sdoh_options]
+
+    menu = dict(type="dropdown",
+                direction="down",
+                xanchor="left",
+                yanchor="top",
+                x=0.01,
+                bgcolor="#f5f5f5",
+                bordercolor="#303030",
+                font=dict(color="#303030", family="Rockwell", size=11),
+                showactive=True,
+                active=0)
+
+    mapp.update_layout(updatemenus=[dict(menu, buttons=lab_buttons, y=0.99),
+                                    dict(menu, buttons=sdoh_buttons, y=0.93)],
+                       # SDOH's description, below the menus
+                       annotations=[dict(text=dict_sdohDescriptions[sdoh_selection],
+                                         xref="paper", yref="paper",
+                                         x=0.01, y=0.87,
+                                         xanchor="left", yanchor="top",
+                                         showarrow=False,
+                                         align="left",
+                                         font=dict(color="#303030", family="Rockwell", size=11))])
+
+    return mapp
+
+
+# Values of a column at the given row positions, -1 (a county missing that year) gives the fill value
+def _at(values, positions, fill):
+    values = np.asarray(values, dtype=object if isinstance(fill, str) else float)
+    return np.where(positions >= 0, values[positions], fill)
+
+
+# Animated Figure over the Years
+# The figure of the last year, plus one animation frame per year carrying only that year's values (choropleth
+# levels, dot colors, colorbar ticks and hover values): the geometry is sent once and never rebuilt.
+# years_data and years_tables map each year to its data and precompute.Tables, in the slider's order.
+def build_animated_figure(years_data, counties, years_tables, lab_selection, sdoh_selection):
+    years = list(years_data)
+    last = years[-1]
+    mapp = build_figure(years_data[last], counties, years_tables[last], lab_selection, sdoh_selection)
+    fips = years_data[last]["COUNTYFIPS"]
+
+    frames = []
+    for year in years:
+        data, tables = years_data[year], years_tables[year]
+        positions = pd.Index(data["COUNTYFIPS"]).get_indexer(fips)
+        customdata = np.column_stack([_at(data[lab_selection], positions, np.nan),
+                                      _at(data[sdoh_selection], positions, np.nan)])
+        frames.append(dict(name=str(year),
+                           traces=[0, 1],
+                           data=[dict(type="choropleth",
+                                      z=_at(tables.colors["color_"+sdoh_selection], positions, np.nan),
+                                      customdata=customdata,
+                                      colorbar=dict(ticktext=list(tables.ticktexts[sdoh_selection]))),
+                                 dict(type="scattergeo",
+                                      customdata=customdata,
+                                      marker=dict(color=_at(tables.colors["color_"+lab_selection], positions,
+                                                            MISSING_LAB_COLOR),
+                                                  cmin=tables.ranges[lab_selection][0],
+                                                  cmax=tables.ranges[lab_selection][1]))]))
+
+    # Geo traces have to be redrawn, they cannot be transitioned
+    animation = dict(mode="immediate", frame=dict(duration=800, redraw=True), transition=dict(duration=0))
+    mapp.update(frames=frames)
+    mapp.update_layout(sliders=[dict(active=len(years) - 1,
+                                     x=0.08, y=0.99, len=0.40,
+                                     xanchor="left", yanchor="top",
+                                     pad=dict(t=0, b=0),
+                                     currentvalue=dict(prefix="Year: ",
+                                                       font=dict(color="#303030", family="Rockwell", size=12)),
+                                     font=dict(color="#303030", family="Rockwell", size=10),
+                                     steps=[dict(label=str(year), method="animate",
+                                                 args=[[str(year)], dict(animation, frame=dict(duration=0, redraw=True))])
+                                            for year in years])],
+                       updatemenus=[dict(type="buttons",
+                                         x=0.01, y=0.99,
+                                         xanchor="left", yanchor="top",
+                                         bgcolor="#f5f5f5",
+                                         bordercolor="#303030",
+                                         font=dict(color="#303030", family="Rockwell", size=11),
+                                         buttons=[dict(label="▶", method="animate", args=[None, animation]),
+                                                  dict(label="❚❚", method="animate",
+                                                       args=[[None], dict(animation, mode="immediate",
+                                                                          frame=dict(duration=0, redraw=False))])])])
+    return mapp
+
+
+# Comparison Grid
+# One map per SDOH (columns), with one row per lab when labs are given (their dots over every map). Every
+# choropleth references the same counties: geojson can be the URL of the published geometry (see
+# geometry.publish), which the browser fetches and parses once for the whole grid, or the GeoJSON itself
+# (then embedded once per map). The colors are the precomputed tables' on a shared scale.
+COMPARISON_COLUMNS = 3
+
+
+def build_comparison_figure(sdoh, counties, tables, sdoh_selections, lab_selections=()):
+    import plotly.graph_objects as go
+    import plotly.express.colors as pc
+
+    rows = list(lab_selections) or [None]
+    n_columns = min(len(sdoh_selections), COMPARISON_COLUMNS)
+    n_rows = len(rows) * -(-len(sdoh_selections) // n_columns)
+    height = n_rows * config.MAP_HEIGHT * 0.95 / n_columns
+
+    font = dict(color="#303030", family="Rockwell", size=11)
+    geo = dict(scope="world",
+               fitbounds=False,
+               visible=False,
+               center=dict(lat=18.155, lon=-66.245),
+               bgcolor="#f5f5f5",
+               projection_scale=config.MAP_PROJECTION_SCALE)
+
+    traces, layout = [], dict(annotations=[])
+    for n, (lab_selection, sdoh_selection) in enumerate((lab, column) for lab in rows for column in sdoh_selections):
+        row, column = divmod(n, n_columns)
+        subplot = "geo" if n == 0 else "geo%d" % (n + 1)
+        x = [column / n_columns, (column + 1) / n_columns]
+        y = [1 - (row + 1) / n_rows, 1 - row / n_rows]
+        layout[subplot] = dict(geo, domain=dict(x=x, y=y))
+
+        title = dict_sdohLabels[sdoh_selection] + ("" if lab_selection is None else " / " + dict_labLabels[lab_selection])
+        layout["annotations"].append(dict(text=title, font=font, showarrow=False,
+                                          xref="paper", yref="paper", x=x[0] + 0.01, y=y[1],
+                                          xanchor="left", yanchor="top"))
+
+        traces.append(go.Choropleth(geo=subplot,
+                                    geojson=counties,
+                                    locations=sdoh["COUNTYFIPS"],
+                                    z=tables.colors["color_"+sdoh_selection],
+                                    zmin=SDOH_COLOR_LEVELS[0],
+                                    zmax=SDOH_COLOR_LEVELS[-1],
+                                    colorscale=pc.sequential.Purples,
+                                    marker=dict(line=dict(color="#303030", width=0.75), opacity=0.925),
+                                    hovertext=sdoh["COUNTY"],
+                                    customdata=sdoh[sdoh_selection],
+                                    hovertemplate="<b>%{hovertext}</b><br><br>" + dict_sdohLabels[sdoh_selection]
+                                                  + "=%{customdata:.0f}<extra></extra>",
+                                    colorbar=dict(orientation="h",      # at the bottom of its map, over the sea
+                                                  x=(x[0] + x[1]) / 2, y=y[0] + 0.05 * (y[1] - y[0]),
+                                                  yanchor="bottom",
+                                                  len=0.8 / n_columns, thickness=10,
+                                                  outlinecolor="black", outlinewidth=1.05,
+                                                  tickmode="array",
+                                                  tickvals=SDOH_TICKVALS[::2],
+                                                  ticktext=list(tables.ticktexts[sdoh_selection][::2]),
+                                                  ticks="inside", tickfont=dict(font, size=9))))
+
+        if lab_selection is not None:
+            traces.append(go.Scattergeo(geo=subplot,
+                                        lat=sdoh["lat"],
+                                        lon=sdoh["lon"],
+                                        hovertext=sdoh["COUNTY"],
+                                        customdata=sdoh[lab_selection],
+                                        hovertemplate="<b>%{hovertext}</b><br><br>" + dict_labLabels[lab_selection]
+                                                      + "=%{customdata:.1f}<extra></extra>",
+                                        marker=dict(size=6,
+                                                    line=dict(width=0.75, color="#303030"),
+                                                    color=tables.colors["color_"+lab_selection],
+                                                    opacity=0.90)))
+
+    layout.update(height=height,
+                  autosize=True,
+                  margin=dict(r=0, t=0, l=0, b=0),
+                  paper_bgcolor="#f5f5f5",
+                  dragmode=False,
+                  showlegend=False,
+                  modebar=dict(color="#303030", activecolor="#d303fc", bgcolor="#f5f5f5",
+                               remove=["zoomIn", "zoomOut", "select", "lasso", "pan", "reset"]))
+    return go.Figure(data=traces, layout=layout)
+
+
+# Compact Serialization
+# A pair figure as sent to the browser, its JSON down to what the map draws:
+#   - numeric arrays (levels, coordinates, hover values) as typed arrays: base64 buffers of float32 or int32
+#     values, decoded by plotly.js (2.28+) without parsing a number list (typed=False keeps number lists)
+#   - customdata cut to [lab, sdoh]: the choropleth's copy of the locations and the dots' coordinates are
+#     dropped (the hover templates only read [0] and [1]). Both traces carry it, plotly.js has no references
+#     between traces.
+#   - the template reduced to the layout fields the map does not set itself
+#   - geojson, when given, replaces the traces' geometry (e.g. the URL of the published counties)
+TEMPLATE = dict(layout=dict(font=dict(color="#2a3f5f"), hovermode="closest", hoverlabel=dict(align="left")))
+
+
+# Typed array specification of a numeric array: int32 when every value is a (finite) integer, else float32
+def _typed(values):
+    import base64
+    values = np.asarray(values, dtype=float)
+    integers = np.isfinite(values).all() and (values == np.round(values)).all() and np.abs(values).max() < 2 ** 31
+    values = values.astype("<i4" if integers else "<f4")
+    spec = dict(dtype="i4" if integers else "f4", bdata=base64.b64encode(values.tobytes()).decode("ascii"))
+    if values.ndim > 1:
+        spec["shape"] = ",".join(map(str, values.shape))
+    return spec
+
+
+def compact_figure(mapp, geojson=None, typed=True):
+    import plotly.graph_objects as go
+
+    spec = mapp.to_dict()
+    encode = _typed if typed else (lambda values: np.asarray(values, dtype=float).tolist())
+    for trace in spec["data"]:
+        trace["customdata"] = encode(np.asarray(trace["customdata"], dtype=float)[:, :2])
+        for name in ("z", "lat", "lon"):
+            if name in trace:
+                trace[name] = encode(trace[name])
+        if geojson is not None and "geojson" in trace:
+            trace["geojson"] = geojson
+
+    spec["layout"]["template"] = TEMPLATE
+    return go.Figure(spec, skip_invalid=False, _validate=False)
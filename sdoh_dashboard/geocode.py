@@ -0,0 +1,228 @@
+import sys
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from . import config, dataset, geometry, tracts
+from .simplify import polygons
+
+
+# Batch Point-in-County Assignment
+# Assigns lon/lat coordinates (patients, facilities, ...) to the COUNTYFIPS of the municipio containing
+# them. A uniform grid over the counties indexes, for each cell, the counties whose borders cross it:
+#   - cells without borders are wholly inside one county (or the sea), answered by a lookup
+#   - points in border cells are ray cast (even-odd rule, vectorized) against their cell's counties only
+# Counties are the full resolution polygons of load_json().
+#
+#   python -m sdoh_dashboard.geocode records.csv --lon lon --lat lat --output records-fips.csv
+
+CELL_SIZE = 0.01           # degrees (~1 km)
+BLOCK_SIZE = 1 << 22       # points x edges compared at once by the ray casting
+CHUNK_SIZE = 1_000_000     # points per worker task and per CSV chunk
+
+
+# Edges of every ring as (x1, y1, x2, y2) rows, grouped by feature: feature i's edges are edges[offsets[i]:offsets[i+1]]
+def _edges(geojson):
+    edges, offsets = [], [0]
+    for feature in geojson["features"]:
+        count = offsets[-1]
+        for polygon in polygons(feature["geometry"]):
+            for ring in polygon:
+                points = np.asarray(ring, dtype=float)[:, :2]
+                if not np.array_equal(points[0], points[-1]):
+                    points = np.vstack([points, points[:1]])
+                edges.append(np.hstack([points[:-1], points[1:]]))
+                count += len(points) - 1
+        offsets.append(count)
+    return np.vstack(edges), np.array(offsets)
+
+
+# Even-odd ray casting (towards +x) of every point against a set of edges, in blocks of BLOCK_SIZE comparisons
+def _inside(x, y, edges):
+    x1, y1, x2, y2 = edges.T
+    inside = np.zeros(len(x), dtype=bool)
+    step = max(1, BLOCK_SIZE // max(len(edges), 1))
+    for start in range(0, len(x), step):
+        px, py = x[start:start + step, None], y[start:start + step, None]
+        straddles = (y1 > py) != (y2 > py)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            crossing = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        inside[start:start + step] = (straddles & (px < crossing)).sum(axis=1) % 2 == 1
+    return inside
+
+
+# Indices of the repeated rows of a CSR: for counts [2, 3] -> [0, 1, 0, 1, 2]
+def _ranges(counts):
+    return np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+
+class CountyIndex:
+
+    def __init__(self, geojson, cell=CELL_SIZE):
+        self.fips = np.array([feature["id"] for feature in geojson["features"]] + [""])   # "" outside every county
+        self.edges, offsets = _edges(geojson)
+        self.cell = cell
+
+        x = self.edges[:, [0, 2]]
+        y = self.edges[:, [1, 3]]
+        self.origin = np.array([x.min(), y.min()])
+        self.shape = (int((x.max() - self.origin[0]) // cell) + 1, int((y.max() - self.origin[1]) // cell) + 1)
+        n_x, n_y = self.shape
+        self.n_features = n_features = len(offsets) - 1
+        owners = np.repeat(np.arange(n_features), np.diff(offsets))
+
+        # Cells covered by each edge's bounding box (a superset of the cells it crosses)
+        low = ((np.minimum(self.edges[:, :2], self.edges[:, 2:]) - self.origin) // cell).astype(int)
+        high = ((np.maximum(self.edges[:, :2], self.edges[:, 2:]) - self.origin) // cell).astype(int)
+        widths, heights = high[:, 0] - low[:, 0] + 1, high[:, 1] - low[:, 1] + 1
+        counts = widths * heights
+        k = _ranges(counts)
+        cells = ((np.repeat(low[:, 1], counts) + k // np.repeat(widths, counts)) * n_x
+                 + np.repeat(low[:, 0], counts) + k % np.repeat(widths, counts))
+
+        # Cell -> counties with a border in it (CSR)
+        pairs = np.unique(cells * n_features + np.repeat(owners, counts))
+        self.candidates = pairs % n_features
+        self.indptr = np.searchsorted(pairs // n_features, np.arange(n_x * n_y + 1))
+
+        # (row, county) -> the county's edges in that row. A horizontal ray only crosses the edges of its own
+        # row, so a point is tested against those instead of every edge of the county.
+        bands = np.repeat(low[:, 1], heights) + _ranges(heights)
+        keys = bands * n_features + np.repeat(owners, heights)
+        order = np.argsort(keys, kind="stable")
+        self.band_edges = np.repeat(np.arange(len(self.edges)), heights)[order]
+        self.band_indptr = np.searchsorted(keys[order], np.arange(n_y * n_features + 1))
+
+        # County of every cell without borders (-1: sea), from its center, tested against the counties
+        # with edges in its row
+        self.labels = np.full(n_x * n_y, -1)
+        empty = np.flatnonzero(np.diff(self.indptr) == 0)
+        centers = self.origin + (np.column_stack([empty % n_x, empty // n_x]) + 0.5) * cell
+        row_keys = np.flatnonzero(np.diff(self.band_indptr) > 0)
+        row_indptr = np.searchsorted(row_keys // n_features, np.arange(n_y + 1))
+        rows = empty // n_x
+        counts = row_indptr[rows + 1] - row_indptr[rows]
+        pair_features = row_keys[np.repeat(row_indptr[rows], counts) + _ranges(counts)] % n_features
+        self._cast(centers[:, 0], centers[:, 1], np.repeat(np.arange(len(empty)), counts), np.repeat(rows, counts),
+                   pair_features, self.labels, empty)
+
+    # Ray casts the (point, county) pairs, grouped by (row, county), and writes the county of the points inside
+    # it into result[point] (or result[targets[point]])
+    def _cast(self, x, y, points, rows, features, result, targets=None):
+        keys = rows * self.n_features + features
+        order = np.argsort(keys, kind="stable")
+        points, keys = points[order], keys[order]
+        unique_keys, starts = np.unique(keys, return_index=True)
+        for key, group in zip(unique_keys, np.split(points, starts[1:])):
+            edges = self.edges[self.band_edges[self.band_indptr[key]:self.band_indptr[key + 1]]]
+            inside = _inside(x[group], y[group], edges)
+            result[group[inside] if targets is None else targets[group[inside]]] = key % self.n_features
+
+    # Feature index of the county containing each point, -1 outside every county (and for NaN coordinates)
+    def locate(self, lon, lat):
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        result = np.full(len(lon), -1)
+
+        with np.errstate(invalid="ignore"):
+            ix = np.floor((lon - self.origin[0]) / self.cell)
+            iy = np.floor((lat - self.origin[1]) / self.cell)
+            on_grid = np.flatnonzero((ix >= 0) & (ix < self.shape[0]) & (iy >= 0) & (iy < self.shape[1]))
+        rows = iy[on_grid].astype(int)
+        cells = rows * self.shape[0] + ix[on_grid].astype(int)
+        result[on_grid] = self.labels[cells]
+
+        # Points in border cells: one (point, county) pair per county with a border in the cell
+        counts = self.indptr[cells + 1] - self.indptr[cells]
+        border = counts > 0
+        points, rows, cells, counts = on_grid[border], rows[border], cells[border], counts[border]
+        pair_features = self.candidates[np.repeat(self.indptr[cells], counts) + _ranges(counts)]
+        self._cast(lon, lat, np.repeat(points, counts), np.repeat(rows, counts), pair_features, result)
+        return result
+
+    # COUNTYFIPS of the county containing each point, "" outside every county. Inputs larger than
+    # chunksize are split across worker processes when workers > 1.
+    def assign(self, lon, lat, workers=1, chunksize=CHUNK_SIZE):
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        if workers <= 1 or len(lon) <= chunksize:
+            return self.fips[self.locate(lon, lat)]
+
+        chunks = range(0, len(lon), chunksize)
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), initializer=_set_worker_index,
+                                 initargs=(self,), mp_context=multiprocessing.get_context("spawn")) as executor:
+            located = executor.map(_worker_locate, [lon[start:start + chunksize] for start in chunks],
+                                   [lat[start:start + chunksize] for start in chunks])
+            return self.fips[np.concatenate(list(located))]
+
+
+# The index is sent once to each worker process, not with every chunk
+_worker_index = None
+
+
+def _set_worker_index(index):
+    global _worker_index
+    _worker_index = index
+
+
+def _worker_locate(lon, lat):
+    return _worker_index.locate(lon, lat)
+
+
+# Index over the counties of the dataset, at full resolution
+def load_index(cell=CELL_SIZE, allow_network=config.ALLOW_NETWORK, sources=geometry.GEOJSON_SOURCES):
+    fips = dataset.read(["COUNTYFIPS"])["COUNTYFIPS"]
+    return CountyIndex(geometry.load_json(tuple(fips), allow_network, sources), cell)
+
+
+# Index over the census tracts of the tract dataset, at full resolution (a finer grid for the smaller polygons)
+def load_tract_index(cell=CELL_SIZE / 2, sources=tracts.GEOJSON_SOURCES):
+    fips = dataset.read([tracts.TRACT_COLUMN], parquet_path=tracts.PARQUET_PATH,
+                        csv_path=tracts.CSV_PATH)[tracts.TRACT_COLUMN]
+    return CountyIndex(geometry.load_json(tuple(fips), False, sources), cell)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Assigns the COUNTYFIPS of the municipio containing each point.")
+    parser.add_argument("path", help="CSV file with longitude and latitude columns")
+    parser.add_argument("--output", required=True, help="CSV file written with an added COUNTYFIPS column")
+    parser.add_argument("--lon", default="lon")
+    parser.add_argument("--lat", default="lat")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--cell", type=float, help="grid cell size in degrees")
+    parser.add_argument("--level", choices=["county", "tract"], default="county",
+                        help="tract also adds a TRACTFIPS column (needs the tract data and GeoJSON)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    tract_level = args.level == "tract"
+    index = load_tract_index(args.cell or CELL_SIZE / 2) if tract_level else load_index(args.cell or CELL_SIZE)
+    print("Index: %d areas, %d edges, %dx%d cells (%.0f ms)"
+          % (len(index.fips) - 1, len(index.edges), *index.shape, (time.perf_counter() - start) * 1000))
+
+    total = assigned = 0
+    start = time.perf_counter()
+    # Chunks of the CSV are processed (and split across the workers) one at a time
+    for number, chunk in enumerate(pd.read_csv(args.path, chunksize=args.chunksize * max(args.workers, 1))):
+        fips = index.assign(chunk[args.lon], chunk[args.lat], args.workers, args.chunksize)
+        if tract_level:
+            chunk[tracts.TRACT_COLUMN] = fips
+            fips = fips.astype("<U5")           # a tract's FIPS starts with its county's
+        chunk["COUNTYFIPS"] = fips
+        chunk.to_csv(args.output, mode="w" if number == 0 else "a", header=number == 0, index=False)
+        total += len(chunk)
+        assigned += int((chunk["COUNTYFIPS"] != "").sum())
+
+    seconds = time.perf_counter() - start
+    print("Assigned %d of %d points in %.2f s (%.0f points/s), wrote %s"
+          % (assigned, total, seconds, total / max(seconds, 1e-9), args.output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
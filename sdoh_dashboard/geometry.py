@@ -0,0 +1,129 @@
+import os
+import ssl
+import glob
+import json
+import hashlib
+from typing import NamedTuple
+from urllib.request import urlopen
+
+from . import config
+from . import simplify
+
+
+# Counties Map Information (GeoJSON)
+# Resolution order: bundled file -> on-disk cache -> network (only when allowed), or only SDOH_GEOJSON when set
+GEOJSON_URL = "https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json"
+GEOJSON_BUNDLED = os.path.join(config.BASE_DIR, "geojson-counties-fips-pr.json")
+GEOJSON_CACHE = os.path.join(config.CACHE_DIR, "geojson-counties-fips-pr.json")
+GEOJSON_SOURCES = (config.GEOJSON_PATH,) if config.GEOJSON_PATH else (GEOJSON_BUNDLED, GEOJSON_CACHE)
+
+
+class Counties(NamedTuple):
+    geojson: dict       # FeatureCollection sent to the map
+    tolerance: float    # simplification tolerance in degrees, None at full resolution
+    version: str        # content hash, part of the figure cache keys
+
+
+# Keeps only the features (counties) whose FIPS are in the dataset
+def prune_counties(geojson, fips):
+    fips = set(fips)
+    return {"type": "FeatureCollection",
+            "features": [feature for feature in geojson["features"] if feature["id"] in fips]}
+
+
+# Reads a GeoJSON file, returns None if missing or unreadable
+def read_counties(path):
+    try:
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)
+
+    except (OSError, json.decoder.JSONDecodeError):
+        return None
+
+
+# Downloads the full US counties GeoJSON (~3,200 counties)
+def fetch_counties():
+    with urlopen(GEOJSON_URL, context=ssl.create_default_context(), timeout=30) as response:
+        return json.load(response)
+
+
+# Writes the pruned counties to the on-disk cache, a failed write only costs a future download
+def write_counties(geojson, path):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(geojson, file, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+
+    except OSError as error:
+        print("Failed to write counties cache:", error)
+
+
+# Full resolution counties, pruned to the given FIPS
+def load_json(fips, allow_network=config.ALLOW_NETWORK, sources=GEOJSON_SOURCES):
+    for path in sources:
+        counties = read_counties(path)
+        if counties is not None:
+            return prune_counties(counties, fips)
+
+    if not allow_network:
+        raise FileNotFoundError("Counties GeoJSON not found in %s, and network fallback is disabled "
+                                "(set SDOH_ALLOW_NETWORK=1 to download it)" % " or ".join(sources))
+
+    counties = prune_counties(fetch_counties(), fips)
+    write_counties(counties, GEOJSON_CACHE)
+    return counties
+
+
+# Simplification tolerance (degrees) for a level of detail, None keeps full resolution
+def map_tolerance(topology, detail=config.MAP_DETAIL, vertices=config.MAP_VERTICES):
+    if vertices:
+        return simplify.tolerance_for_vertices(topology, int(vertices))
+    if detail == "full":
+        return None
+    if detail == "auto":
+        return simplify.tolerance_for_height(config.MAP_HEIGHT, config.MAP_PROJECTION_SCALE)
+    return float(detail)
+
+
+# (path, mtime, size) of the existing GeoJSON sources, changes whenever one is replaced or downloaded
+def signature(sources=GEOJSON_SOURCES):
+    return tuple((path, stat.st_mtime_ns, stat.st_size)
+                 for path, stat in ((path, os.stat(path)) for path in sources if os.path.exists(path)))
+
+
+def version(geojson):
+    return hashlib.sha1(json.dumps(geojson, sort_keys=True).encode()).hexdigest()
+
+
+# Counties at the selected level of detail
+def load_counties(fips, detail=config.MAP_DETAIL, vertices=config.MAP_VERTICES, allow_network=config.ALLOW_NETWORK,
+                  sources=GEOJSON_SOURCES):
+    counties = load_json(fips, allow_network, sources)
+
+    tolerance = None
+    if vertices or detail != "full":
+        topology = simplify.build_topology(counties)
+        tolerance = map_tolerance(topology, detail, vertices)
+        if tolerance is not None:
+            counties = simplify.simplify(topology, tolerance, precision=5)
+
+    return Counties(geojson=counties, tolerance=tolerance, version=version(counties))
+
+
+# Writes the geometry once under the static folder with a content-hashed name (older versions are removed),
+# and returns its URL. Plotly fetches and parses a GeoJSON URL once per page, for every trace that uses it.
+# Returns None when it cannot be written.
+def publish(geojson, version, name="counties", static_dir=config.STATIC_DIR, static_url=config.STATIC_URL):
+    filename = "%s-%s.json" % (name, version[:16])
+    path = os.path.join(static_dir, filename)
+    if not os.path.exists(path):
+        write_counties(geojson, path)
+        for old in glob.glob(os.path.join(static_dir, name + "-*.json")):
+            if old != path:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+
+    return static_url + "/" + filename if os.path.exists(path) else None
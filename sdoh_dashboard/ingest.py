@@ -0,0 +1,183 @@
+import os
+import sys
+import argparse
+import multiprocessing
+from functools import reduce
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from . import dataset
+from .metadata import lab_options
+
+
+# Patient-level Lab Records Ingestion
+# Raw lab results (one row per test: county FIPS, lab, value) are read in chunks and reduced to running
+# aggregates per (COUNTYFIPS, lab): count, mean, sum of squared deviations (M2), min and max. Memory is
+# bounded by the chunk size and the number of counties x labs, never by the number of records.
+# Aggregates of different files are computed by worker processes and merged with Chan et al.'s
+# pairwise update, so the result does not depend on how the records were split.
+#
+#   python -m sdoh_dashboard.ingest records-2023-*.csv --workers 4 --write
+#   python -m sdoh_dashboard.ingest records-tracts.csv --key TRACTFIPS --csv sdoh_tract.csv --parquet sdoh_tract.parquet --write
+
+FIPS_COLUMN = "COUNTYFIPS"
+LAB_COLUMN = "LAB"
+VALUE_COLUMN = "VALUE"
+CHUNK_SIZE = 500_000
+
+# Emitted next to every lab's average
+COUNT_SUFFIX = "_count"
+VAR_SUFFIX = "_var"
+
+STATISTICS = ["count", "mean", "m2", "min", "max"]
+
+
+# Aggregates without any records
+def empty(key=FIPS_COLUMN):
+    return pd.DataFrame({"count": pd.Series(dtype="int64"),
+                         "mean": pd.Series(dtype="float64"),
+                         "m2": pd.Series(dtype="float64"),
+                         "min": pd.Series(dtype="float64"),
+                         "max": pd.Series(dtype="float64")},
+                        index=pd.MultiIndex.from_arrays([[], []], names=[key, LAB_COLUMN]))
+
+
+# Aggregates of one chunk of records, the records of other labs and missing values are skipped
+def aggregate_chunk(chunk, labs=lab_options, key=FIPS_COLUMN):
+    chunk = chunk[chunk[LAB_COLUMN].isin(labs)].dropna(subset=[key, VALUE_COLUMN])
+    if chunk.empty:
+        return empty(key)
+
+    grouped = chunk.groupby([key, LAB_COLUMN], sort=False)[VALUE_COLUMN]
+    aggregates = grouped.agg(["count", "mean", "min", "max"])
+    aggregates["m2"] = grouped.var(ddof=0) * aggregates["count"]
+    return aggregates[STATISTICS]
+
+
+# Merges two aggregates (Chan et al.), vectorized over every (COUNTYFIPS, lab)
+def combine(left, right):
+    if left.empty:
+        return right
+    if right.empty:
+        return left
+
+    index = left.index.union(right.index)
+    left = left.reindex(index)
+    right = right.reindex(index)
+
+    n_left = left["count"].fillna(0).to_numpy()
+    n_right = right["count"].fillna(0).to_numpy()
+    mean_left = left["mean"].fillna(0).to_numpy()
+    mean_right = right["mean"].fillna(0).to_numpy()
+    count = n_left + n_right
+
+    delta = mean_right - mean_left
+    weight = n_right / count
+    return pd.DataFrame({"count": count.astype("int64"),
+                         "mean": mean_left + delta * weight,
+                         "m2": left["m2"].fillna(0).to_numpy() + right["m2"].fillna(0).to_numpy()
+                               + delta ** 2 * n_left * weight,
+                         "min": np.fmin(left["min"].to_numpy(), right["min"].to_numpy()),
+                         "max": np.fmax(left["max"].to_numpy(), right["max"].to_numpy())},
+                        index=index)
+
+
+# Record chunks of a CSV or Parquet file, only the needed columns are read
+def read_chunks(path, chunksize=CHUNK_SIZE, key=FIPS_COLUMN):
+    columns = [key, LAB_COLUMN, VALUE_COLUMN]
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            chunk = batch.to_pandas()
+            chunk[key] = chunk[key].astype(str)
+            yield chunk
+    else:
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize,
+                               dtype={key: str, LAB_COLUMN: str, VALUE_COLUMN: "float64"})
+
+
+# Aggregates of a whole file, chunk by chunk
+def aggregate_file(path, labs=lab_options, chunksize=CHUNK_SIZE, key=FIPS_COLUMN):
+    return reduce(combine, (aggregate_chunk(chunk, labs, key) for chunk in read_chunks(path, chunksize, key)),
+                  empty(key))
+
+
+# Aggregates of several files, one file per worker process (workers=1 runs in this process)
+def aggregate(paths, labs=lab_options, workers=1, chunksize=CHUNK_SIZE, key=FIPS_COLUMN):
+    if workers <= 1 or len(paths) <= 1:
+        partials = [aggregate_file(path, labs, chunksize, key) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(paths)),
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            partials = list(executor.map(aggregate_file, paths, [labs] * len(paths), [chunksize] * len(paths),
+                                         [key] * len(paths)))
+    return reduce(combine, partials, empty(key))
+
+
+# Lab columns as load_data() reads them: "<lab>" (mean), "<lab>_count" and "<lab>_var" (sample variance),
+# one row per COUNTYFIPS (or tract). Counties without records of a lab are left empty.
+def lab_columns(aggregates, labs=lab_options):
+    variance = (aggregates["m2"] / (aggregates["count"] - 1)).where(aggregates["count"] > 1)
+    wide = pd.DataFrame({"mean": aggregates["mean"], "count": aggregates["count"], "var": variance}).unstack(LAB_COLUMN)
+
+    columns = {}
+    for lab in labs:
+        for statistic, suffix in (("mean", ""), ("count", COUNT_SUFFIX), ("var", VAR_SUFFIX)):
+            columns[lab + suffix] = wide[(statistic, lab)] if (statistic, lab) in wide.columns else np.nan
+    return pd.DataFrame(columns, index=wide.index)
+
+
+# Writes the lab columns into sdoh.csv (atomically, every other column is kept as is) and rebuilds
+# sdoh.parquet when it exists. Returns the FIPS of the records that are not in the dataset.
+def write(columns, csv_path=dataset.CSV_PATH, parquet_path=dataset.PARQUET_PATH, key=FIPS_COLUMN):
+    frame = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+    fips = frame[key]
+
+    for name, values in columns.items():
+        values = values.reindex(fips)
+        if name.endswith(COUNT_SUFFIX):
+            frame[name] = values.fillna(0).astype("int64").astype(str).to_numpy()
+        else:
+            frame[name] = values.map(lambda value: "" if pd.isna(value) else repr(float(value))).to_numpy()
+
+    frame.to_csv(csv_path + ".tmp", index=False)
+    os.replace(csv_path + ".tmp", csv_path)
+    if os.path.exists(parquet_path):
+        dataset.build(csv_path, parquet_path)
+
+    return sorted(set(columns.index) - set(fips))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregates patient-level lab records into the county lab columns.")
+    parser.add_argument("paths", nargs="+", help="CSV or Parquet files with %s, %s and %s columns"
+                                                 % (FIPS_COLUMN, LAB_COLUMN, VALUE_COLUMN))
+    parser.add_argument("--key", default=FIPS_COLUMN,
+                        help="geography column of the records and the dataset, TRACTFIPS for sdoh_tract.csv")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--write", action="store_true", help="write the lab columns into sdoh.csv (and sdoh.parquet)")
+    parser.add_argument("--csv", default=dataset.CSV_PATH)
+    parser.add_argument("--parquet", default=dataset.PARQUET_PATH)
+    args = parser.parse_args(argv)
+
+    aggregates = aggregate(args.paths, workers=args.workers, chunksize=args.chunksize, key=args.key)
+    columns = lab_columns(aggregates)
+
+    print("%d records, %d areas" % (aggregates["count"].sum(), len(columns)))
+    for lab, group in aggregates.groupby(level=LAB_COLUMN):
+        print("%-18s %10d records %4d areas  min %10.3f  max %10.3f"
+              % (lab, group["count"].sum(), len(group), group["min"].min(), group["max"].max()))
+
+    if args.write:
+        unknown = write(columns, args.csv, args.parquet, args.key)
+        print("Wrote %s" % args.csv)
+        if unknown:
+            print("Skipped the records of %d areas not in the dataset: %s" % (len(unknown), ", ".join(unknown)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+import sys
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+
+# Per-rerun Instrumentation
+# Named timing spans plus free-form fields (cache hits, payload size, ...), emitted as one JSON line
+# per rerun. A disabled Rerun only costs the calls themselves, so it can be left on in production.
+class Rerun:
+
+    def __init__(self, enabled=True, **fields):
+        self.enabled = enabled
+        self.fields = dict(fields)
+        self.spans = {}
+        self._start = time.perf_counter()
+
+    # Times the block under a name, repeated names add up
+    @contextmanager
+    def span(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans[name] = self.spans.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    def record(self, **fields):
+        if self.enabled:
+            self.fields.update(fields)
+
+    def as_dict(self):
+        return {"ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+                **self.fields,
+                "spans_ms": {name: round(milliseconds, 3) for name, milliseconds in self.spans.items()},
+                "total_ms": round((time.perf_counter() - self._start) * 1000, 3)}
+
+    # Writes the rerun as a single JSON log line and returns it as a dict
+    def emit(self, stream=None):
+        if not self.enabled:
+            return None
+
+        record = self.as_dict()
+        print(json.dumps(record, default=str), file=stream or sys.stdout, flush=True)
+        return record
@@ -0,0 +1,365 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import platform
+import argparse
+import subprocess
+from datetime import datetime, timezone
+from urllib.request import urlopen
+
+import numpy as np
+
+from . import config, geometry
+from .metadata import lab_options, sdoh_options, dict_labLabels, dict_sdohLabels
+
+
+# Concurrent-session Load Test
+# Starts `streamlit run a.py` offline on a local geometry fixture, and drives simulated sessions over
+# Streamlit's websocket the way browsers do: every session reruns the app with a random current_lab or
+# current_sdoh change, waits for the rerun to finish, thinks, and repeats. Sessions are added in stages;
+# each stage records its reruns' latencies and throughput, and the server's CPU and RSS (worker processes
+# included) are sampled throughout. Results are written as JSON and can be compared against a stored run.
+# Streamlit's protobuf messages and the websockets package (a Streamlit dependency) are imported when run.
+#
+#   python -m sdoh_dashboard.loadtest --stages 1,10,50,100 --output load.json
+#   python -m sdoh_dashboard.loadtest --baseline load.json --threshold 0.15
+
+APP_PATH = os.path.join(config.BASE_DIR, "a.py")
+STAGES = (1, 10, 25, 50, 100)
+STAGE_SECONDS = 20.0
+THINK_SECONDS = 0.5         # mean pause between a session's reruns (exponential), 0 for back-to-back reruns
+SAMPLE_SECONDS = 0.5        # server CPU and RSS sampling interval
+RERUN_TIMEOUT = 120.0
+
+WIDGET_KEYS = {"current_lab": (lab_options, dict_labLabels),
+               "current_sdoh": (sdoh_options, dict_sdohLabels)}
+
+# Compared against the baseline: (section, statistic, True when higher is worse)
+COMPARED = [("latency", "p50_ms", True), ("latency", "p95_ms", True), ("latency", "p99_ms", True),
+            ("saturation", "reruns_per_s", False), ("resources", "peak_rss_kib", True)]
+
+
+def _summary(samples):
+    milliseconds = np.array(samples) * 1000
+    if not len(milliseconds):
+        return {"n": 0}
+    return {"n": len(milliseconds),
+            **{"p%d_ms" % q: round(float(np.percentile(milliseconds, q)), 3) for q in (50, 90, 95, 99)},
+            "mean_ms": round(float(milliseconds.mean()), 3),
+            "max_ms": round(float(milliseconds.max()), 3)}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Streamlit server on a port, offline (no downloads) and reading the counties from the fixture
+def start_server(port, geojson, app_path=APP_PATH):
+    env = dict(os.environ, SDOH_ALLOW_NETWORK="0", SDOH_GEOJSON=os.path.abspath(geojson))
+    return subprocess.Popen([sys.executable, "-m", "streamlit", "run", app_path,
+                             "--server.headless", "true",
+                             "--server.port", str(port),
+                             "--server.address", "127.0.0.1",
+                             "--browser.gatherUsageStats", "false"],
+                            cwd=os.path.dirname(app_path), env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(port, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urlopen("http://127.0.0.1:%d/_stcore/health" % port, timeout=1) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError("Streamlit server not ready after %.0f s" % timeout)
+
+
+# One simulated browser tab
+class Session:
+
+    def __init__(self, url, rng):
+        self.url = url
+        self.rng = rng
+        self.widgets = {}       # key -> (widget id, selectbox proto)
+        self.values = {}        # key -> selected option
+        self._websocket = None
+
+    async def connect(self):
+        import websockets
+        self._websocket = await websockets.connect(self.url, subprotocols=["streamlit"], max_size=None)
+
+    async def close(self):
+        if self._websocket is not None:
+            await self._websocket.close()
+
+    # Widget state of a selectbox: the option's label on Streamlit versions whose selectboxes have a
+    # raw_value, its index on older ones
+    def _state(self, widget_id, proto, key):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        options, labels = WIDGET_KEYS[key]
+        if "raw_value" in proto.DESCRIPTOR.fields_by_name:
+            return WidgetState(id=widget_id, string_value=labels[self.values[key]])
+        return WidgetState(id=widget_id, int_value=list(options).index(self.values[key]))
+
+    # Reruns the app with the current selection, returns (seconds, bytes received) once the script finished
+    async def rerun(self):
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        message = BackMsg()
+        message.rerun_script.query_string = ""
+        message.rerun_script.page_script_hash = ""
+        for key, (widget_id, proto) in self.widgets.items():
+            message.rerun_script.widget_states.widgets.append(self._state(widget_id, proto, key))
+
+        start = time.perf_counter()
+        received = 0
+        await self._websocket.send(message.SerializeToString())
+        while True:
+            data = await asyncio.wait_for(self._websocket.recv(), RERUN_TIMEOUT)
+            received += len(data)
+            forward = ForwardMsg()
+            forward.ParseFromString(data)
+            kind = forward.WhichOneof("type")
+
+            if kind == "delta" and forward.delta.WhichOneof("type") == "new_element" \
+                    and forward.delta.new_element.WhichOneof("type") == "selectbox":
+                proto = forward.delta.new_element.selectbox
+                key = proto.id.rsplit("-", 1)[-1]
+                if key in WIDGET_KEYS:
+                    self.widgets[key] = (proto.id, proto)
+                    self.values.setdefault(key, WIDGET_KEYS[key][0][proto.default])
+
+            elif kind == "script_finished":
+                return time.perf_counter() - start, received
+
+    # Changes the lab or the SDOH to another random option
+    def change(self):
+        key = self.rng.choice(sorted(self.widgets))
+        options = [option for option in WIDGET_KEYS[key][0] if option != self.values[key]]
+        self.values[key] = self.rng.choice(options)
+
+
+# Server's CPU (%, of one core) and RSS, its worker processes included
+class Sampler:
+
+    def __init__(self, pid):
+        import psutil
+        self.process = psutil.Process(pid)
+        self.samples = []
+        self._last = None
+
+    def _cpu_seconds(self):
+        times = self.process.cpu_times()
+        total = times.user + times.system + times.children_user + times.children_system
+        rss = self.process.memory_info().rss
+        for child in self.process.children(recursive=True):
+            try:
+                total += sum(child.cpu_times()[:2])
+                rss += child.memory_info().rss
+            except Exception:      # exited meanwhile
+                pass
+        return total, rss
+
+    def sample(self, elapsed, stage):
+        now = time.perf_counter()
+        cpu, rss = self._cpu_seconds()
+        if self._last is not None:
+            self.samples.append({"t": round(elapsed, 3),
+                                 "sessions": stage,
+                                 "cpu_percent": round((cpu - self._last[1]) / (now - self._last[0]) * 100, 1),
+                                 "rss_kib": rss // 1024})
+        self._last = (now, cpu)
+
+
+async def _sample(sampler, start, state, stop):
+    while not stop.is_set():
+        sampler.sample(time.perf_counter() - start, state["sessions"])
+        try:
+            await asyncio.wait_for(stop.wait(), SAMPLE_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+# A session's loop: connect, load the page, then change the selection until stopped
+async def _drive(url, rng, think, state, stop):
+    session = Session(url, rng)
+    try:
+        await session.connect()
+        await session.rerun()
+        while not stop.is_set():
+            if think:
+                await asyncio.sleep(rng.expovariate(1 / think))
+            session.change()
+            seconds, received = await session.rerun()
+            state["reruns"].append((time.perf_counter(), seconds, received))
+
+    except Exception as error:      # counted, the other sessions carry on
+        state["errors"].append(repr(error))
+    finally:
+        await session.close()
+
+
+async def _run(port, pid, stages, stage_seconds, think, seed):
+    url = "ws://127.0.0.1:%d/_stcore/stream" % port
+    rng = random.Random(seed)
+    state = {"sessions": 0, "reruns": [], "errors": []}
+    stop = asyncio.Event()
+
+    # Cold start: the first page load of a new server process (data, geometry, tables, first figure)
+    first = Session(url, rng)
+    await first.connect()
+    cold_start = (await first.rerun())[0]
+    await first.close()
+
+    start = time.perf_counter()
+    sampler = None
+    try:
+        sampler = Sampler(pid)
+    except ImportError:
+        print("psutil is not installed, the server's CPU and RSS are not sampled")
+    sampling = asyncio.ensure_future(_sample(sampler, start, state, stop)) if sampler else None
+
+    tasks, results = [], []
+    for sessions in stages:
+        while len(tasks) < sessions:
+            tasks.append(asyncio.ensure_future(_drive(url, random.Random(rng.random()), think, state, stop)))
+        state["sessions"] = sessions
+        stage_start = time.perf_counter()
+        await asyncio.sleep(stage_seconds)
+        stage_end = time.perf_counter()
+
+        reruns = [rerun for rerun in state["reruns"] if stage_start <= rerun[0] < stage_end]
+        resources = [sample for sample in (sampler.samples if sampler else []) if sample["sessions"] == sessions]
+        results.append({"sessions": sessions,
+                        "seconds": round(stage_end - stage_start, 3),
+                        "reruns": len(reruns),
+                        "reruns_per_s": round(len(reruns) / (stage_end - stage_start), 3),
+                        "latency": _summary([rerun[1] for rerun in reruns]),
+                        "bytes_per_rerun": int(np.mean([rerun[2] for rerun in reruns])) if reruns else None,
+                        "cpu_percent_mean": round(float(np.mean([s["cpu_percent"] for s in resources])), 1)
+                                            if resources else None,
+                        "rss_kib_max": max((s["rss_kib"] for s in resources), default=None)})
+        print("%5d sessions  %7.2f reruns/s  p50 %8.1f ms  p95 %8.1f ms  CPU %6s%%  RSS %8s KiB"
+              % (sessions, results[-1]["reruns_per_s"], results[-1]["latency"].get("p50_ms", float("nan")),
+                 results[-1]["latency"].get("p95_ms", float("nan")), results[-1]["cpu_percent_mean"],
+                 results[-1]["rss_kib_max"]))
+
+    stop.set()
+    await asyncio.gather(*tasks)
+    if sampling:
+        await sampling
+
+    saturation = max(results, key=lambda stage: stage["reruns_per_s"])
+    samples = sampler.samples if sampler else []
+    return {"cold_start_ms": round(cold_start * 1000, 3),
+            "stages": results,
+            "latency": _summary([rerun[1] for rerun in state["reruns"]]),
+            # Highest throughput reached, and the latency at that load
+            "saturation": {"sessions": saturation["sessions"],
+                           "reruns_per_s": saturation["reruns_per_s"],
+                           "p95_ms": saturation["latency"].get("p95_ms")},
+            "resources": {"peak_rss_kib": max((s["rss_kib"] for s in samples), default=None),
+                          "peak_cpu_percent": max((s["cpu_percent"] for s in samples), default=None),
+                          "samples": samples},
+            "errors": {"count": len(state["errors"]), "first": state["errors"][:5]}}
+
+
+def run(geojson, stages=STAGES, stage_seconds=STAGE_SECONDS, think=THINK_SECONDS, seed=0, port=None,
+        app_path=APP_PATH):
+    import streamlit
+
+    port = port or free_port()
+    server = start_server(port, geojson, app_path)
+    try:
+        wait_ready(port)
+        results = asyncio.run(_run(port, server.pid, stages, stage_seconds, think, seed))
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    return {"meta": {"timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                     "python": platform.python_version(),
+                     "platform": platform.platform(),
+                     "cpus": os.cpu_count(),
+                     "streamlit": streamlit.__version__,
+                     "geojson": os.path.basename(geojson),
+                     "stage_seconds": stage_seconds,
+                     "think_seconds": think,
+                     "seed": seed},
+            **results}
+
+
+# Relative changes against a baseline, the ones worse than the threshold are regressions
+def compare(results, baseline, threshold):
+    rows = []
+    for section, statistic, higher_is_worse in COMPARED:
+        current = results.get(section, {}).get(statistic)
+        previous = baseline.get(section, {}).get(statistic)
+        if not current or not previous:
+            continue
+        change = current / previous - 1
+        rows.append((section, statistic, previous, current, change,
+                     change > threshold if higher_is_worse else change < -threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-tests the dashboard with concurrent simulated sessions.")
+    parser.add_argument("--geojson", default=geometry.GEOJSON_BUNDLED,
+                        help="counties GeoJSON fixture (default: the bundled file)")
+    parser.add_argument("--stages", default=",".join(map(str, STAGES)),
+                        help="concurrent sessions of each stage (default %(default)s)")
+    parser.add_argument("--stage-seconds", type=float, default=STAGE_SECONDS)
+    parser.add_argument("--think", type=float, default=THINK_SECONDS,
+                        help="mean seconds between a session's reruns, 0 for back-to-back reruns")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, help="server port (default: a free one)")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against the results stored in this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed relative change (default 0.15)")
+    args = parser.parse_args(argv)
+
+    try:
+        import websockets  # noqa: F401
+    except ImportError:
+        parser.error("the load test needs the websockets package (pip install websockets)")
+
+    stages = sorted(int(sessions) for sessions in args.stages.split(","))
+    results = run(args.geojson, stages, args.stage_seconds, args.think, args.seed, args.port)
+    print("cold start: %.0f ms, saturation: %.2f reruns/s at %d sessions, peak RSS: %s KiB, errors: %d"
+          % (results["cold_start_ms"], results["saturation"]["reruns_per_s"], results["saturation"]["sessions"],
+             results["resources"]["peak_rss_kib"], results["errors"]["count"]))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+
+        rows = compare(results, baseline, args.threshold)
+        print("\n%-12s %-14s %12s %12s %8s" % ("section", "statistic", "baseline", "current", "change"))
+        for section, statistic, previous, current, change, regressed in rows:
+            print("%-12s %-14s %12.2f %12.2f %+7.1f%%%s" % (section, statistic, previous, current, change * 100,
+                                                          "  REGRESSION" if regressed else ""))
+        if any(row[-1] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
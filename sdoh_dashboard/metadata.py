@@ -0,0 +1,128 @@
+# Columns and Labels to use in "SDOHs Dropdown Menu"
+sdoh_options = [
+    # poverty
+    "ACS_PCT_INC50_ABOVE65",          
+    "ACS_PCT_HEALTH_INC_BELOW137",
+    "ACS_PCT_HEALTH_INC_138_199",
+    "ACS_PCT_HEALTH_INC_200_399",
+    "ACS_PCT_HEALTH_INC_ABOVE400",
+    "ACS_PCT_HH_PUB_ASSIST",
+    # education
+    "ACS_PCT_COLLEGE_ASSOCIATE_DGR",
+    "ACS_PCT_BACHELOR_DGR",
+    "ACS_PCT_GRADUATE_DGR",
+    "ACS_PCT_HS_GRADUATE",
+    "ACS_PCT_LT_HS",
+    "ACS_PCT_POSTHS_ED",
+    # employment
+    "ACS_TOT_CIVIL_EMPLOY_POP",
+    # insurance coverage
+    "ACS_PCT_UNINSURED",
+    # healthcare access
+    "HIFLD_MIN_DIST_UC",
+    "POS_MIN_DIST_ED",
+    "POS_MIN_DIST_ALC",
+    # disability
+    "ACS_PCT_DISABLE",
+    "ACS_PCT_NONVET_DISABLE_18_64",
+    "ACS_PCT_VET_DISABLE_18_64",
+    # mental health
+    "MMD_ANXIETY_DISD",
+    "MMD_DEPR_DISD"
+    ]        
+
+labels_for_counties = [
+    # poverty
+    "Percentage of People Under 0.50 of the Income-to-Poverty Ratio (Ages 65 and over) ",
+    "Percentage of People Under 1.37 of the Poverty Threshold ",
+    "Percentage of People Between 1.38 and 1.99 of the Poverty Threshold ",
+    "Percentage of People Between 2.00 and 3.99 of the Poverty Threshold ",
+    "Percentage of People Over 4.00 of the Poverty Threshold ",
+    "Percentage of Families With Public Income or Food Asssitance ",
+    # education
+    "Percentage of People with Some College or Associate's Degree (Ages 25 and over) ",
+    "Percentage of People with a Bachelor's Degree (Ages 25 and over) ",
+    "Percentage of People with a Master's Degree, Professional School Degree, or Doctoral Degree (Ages 25 and over) ",
+    "Percentage of People with only high school diploma (Ages 25 and over) ",
+    "Percentage of People with Less Than High School Education (Ages 25 and over) ",
+    "Percentage of People With Any Postsecondary Education (Ages 25 and over) ",
+    # employment
+    "Number of Employed Civilians (Thousands) ",
+    # insurance converage
+    "Percentage of People without Health Insurance Coverage ",
+    # healthcare access
+    "Miles to Nearest Urgent Care ",
+    "Distance in Miles to the Nearest Emergency Department ",
+    "Distance in Miles to the Nearest Hospital With Alcohol and Drug Abuse Inpatient Care ",
+    # disability
+    "Percentage of People with a Disability ",
+    "Percentage of Nonveteran Civilians With a Disability (Ages Between 18 and 64) ",
+    "Percentage of Veteran Civilians With a Disability (Ages Between 18 and 64) ",
+    # mental health
+    "Prevalence of Anxiety Disorders Among Medicare Beneficiaries ",
+    "Prevalence of Depressive Disorders Among Medicare Beneficiaries "
+    ]
+
+descriptions_for_counties = [
+    # poverty
+    "Percentage of People with Ratio of Income to Poverty Ratio Under 0.50 (Ages 65 and over)."
+    " (Income-to-Poverty Ratio (IPR)- Total Family Income divided by the Poverty Threshold).",
+    "Percentage of People Under 1.37 of the Poverty Threshold (Relevant for Health Insurance Coverage)."
+    " (Measured by the Annual Cost of Necessities).",
+    "Percentage of People Between 1.38 and 1.99 of the Poverty Threshold (Relevant for Health Insurance Coverage)."
+    " (Measured by the Annual Cost of Necessities).",
+    "Percentage of People Between 2.00 and 3.99 of the Poverty Threshold (Relevant for Health Insurance Coverage)."
+    " (Measured by the Annual Cost of Necessities).",
+    "Percentage of People Over 4.00 of the Poverty Threshold (Relevant for Health Insurance Coverage)."
+    " (Measured by the Annual Cost of Necessities).",
+    "Percentage of Families that receive Public Assistance Income or Food Stamps/SNAP." 
+    " (Supplemental Nutrition Assistance Program).",
+    # education
+    "Percentage of People with Some College or Associate's Degree (Ages 25 and over).",
+    "Percentage of People with a Bachelor's Degree (Ages 25 and over).",
+    "Percentage of People with a Master's Degree, Professional School Degree, or Doctoral Degree (Ages 25 and over).",
+    "Percentage of People with Only High School Diploma (Ages 25 and over).",
+    "Percentage of People With Less Than a High School Education (Ages 25 and over).",
+    "Percentage of People With Any Postsecondary Education (Ages 25 and over).",
+    # employment
+    "Number (Thousands) of Employed Civilians (Ages 16 and over).",
+    # insurance converage
+    "Percentage of People Without Health Insurance Coverage.",
+    # healthcare access
+    "Distance in Miles to the Nearest Urgent Care Center (based on ZIP Codes).",
+    "Distance in Miles to the Nearest Emergency Department (based on ZIP Codes).",
+    "Distance in Miles to the Nearest Hospital With Alcohol and Drug Abuse Inpatient Care (based on ZIP Codes).",
+    # disability
+    "Percentage of People with a Disability.",
+    "Percentage of Nonveteran Civilians With a Disability (Ages Between 18 and 64).",
+    "Percentage of Veteran Civilians With a Disability (Ages Between 18 and 64).",
+    # mental health
+    "Prevalence of Anxiety Disorders Among Medicare (Dual and Non-dual) Beneficiaries.",
+    "Prevalence of Depressive Disorders Among Medicare (Dual and Non-dual) Beneficiaries."
+    ]    
+
+dict_sdohLabels = dict(zip(sdoh_options, labels_for_counties))
+
+dict_sdohDescriptions = dict(zip(sdoh_options, descriptions_for_counties))
+
+
+
+# Columns and Labels to use in "Labs Menu"
+lab_options = ["albumin_urine", "bun", "creatinine_serum", "creatinine_urine"]
+
+labels_for_dots = ["Average of Albumin Urine lab test ", 
+                   "Average of Blood Urea Nitrogen lab test ", 
+                   "Average of Creatinine Serum lab test ", 
+                   "Average of Creatinine Urine lab test "]
+
+lab_dticks = [5, 2, 0.1, 15]
+
+
+dict_labLabels = dict(zip(lab_options, labels_for_dots))
+dict_labsDticks = dict(zip(lab_options, lab_dticks))
+
+
+
+# Dictionary with all labels
+dict_Labels = {**dict_labLabels, **dict_sdohLabels}
+dict_Labels["COUNTY"] = "County "
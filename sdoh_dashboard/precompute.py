@@ -0,0 +1,82 @@
+import warnings
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+
+# Quantile edges of the color bins, 18 edges -> 17 bins (same as the describe() percentiles)
+QUANTILES = np.arange(start=0.0, stop=1.01, step=0.0588)
+N_BINS = len(QUANTILES) - 1
+
+# SDOH colorbar ticks, labeled with the 17.64% ... 99.96% quantiles
+SDOH_TICKVALS = [3000000, 4000000, 5000000, 6000000, 7000000, 8000000, 9000000, 10000000,
+                 11000000, 12000000, 13000000, 14000000, 15000000, 16000000, 17000000]
+TICK_QUANTILES = slice(3, None)
+
+# Choropleth z value of each SDOH color bin, placed on the colorscale against SDOH_TICKVALS
+SDOH_COLOR_LEVELS = np.array([4128893, 4787846, 5515151, 6241433, 6967715, 7694254, 8420794, 9407425, 10394312,
+                              11381714, 12369372, 13356003, 14342891, 15000560, 15724021, 16119033, 16579581])
+
+# Marker color of the counties without lab data
+MISSING_LAB_COLOR = "rgb(189,189,189)"
+
+
+class Tables(NamedTuple):
+    colors: pd.DataFrame   # "color_<column>" encodings: SDOH z levels and lab "rgb(...)" marker colors
+    ticktexts: dict        # SDOH column -> colorbar tick labels for SDOH_TICKVALS
+    ranges: dict           # column -> (min, max), the lab colorbars' limits
+    edges: pd.DataFrame    # quantile edges (rows) of every column's color bins
+
+
+# Colors evenly spaced along a colorscale given as "rgb(r,g,b)" strings, channels truncated to integers
+# (as the encodings sdoh.csv used to carry)
+def sample_colorscale(colorscale, n):
+    stops = np.array([[float(x) for x in color[color.index("(") + 1:-1].split(",")] for color in colorscale])
+    positions = np.linspace(0, 1, len(stops))
+    samples = np.linspace(0, 1, n)
+    rgb = np.column_stack([np.interp(samples, positions, stops[:, i]) for i in range(3)])
+    return np.array(["rgb(%d,%d,%d)" % tuple(color) for color in rgb])
+
+
+# Quantile bins, tick labels and color encodings of every SDOH and lab, in one pass over a 2-D array.
+# Runs once per dataset version, the render path only looks the results up.
+def precompute(sdoh, sdoh_options, lab_options, lab_colorscale):
+    columns = list(sdoh_options) + list(lab_options)
+    values = sdoh[columns].to_numpy(dtype=float)                    # (counties, measures)
+    missing = np.isnan(values)
+
+    # A column without any data (e.g. labs at tract level) gets NaN edges and ranges, without warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        edges = np.nanquantile(values, QUANTILES, axis=0)            # (edges, measures)
+        minimums, maximums = np.nanmin(values, axis=0), np.nanmax(values, axis=0)
+    # Bin of every value, ties always landing in adjacent bins:
+    #   - a column with at most N_BINS distinct values (e.g. the MMD counts) gives each value its own bin, in order
+    #   - else the number of distinct edges at or below the value, minus one. Only the lowest edge counts its
+    #     copies, so a block of minimum values (e.g. 0 %) leaves the first bin empty, as sdoh.csv encoded it.
+    bins = np.zeros(values.shape, dtype=int)
+    for j in range(values.shape[1]):
+        column = values[:, j]
+        distinct_values = np.unique(column[~np.isnan(column)])
+        if len(distinct_values) <= N_BINS:
+            bins[:, j] = np.searchsorted(distinct_values, column)
+            continue
+        distinct = np.unique(edges[:, j])
+        bins[:, j] = np.searchsorted(distinct, column, side="right") - 1 + (edges[:, j] == distinct[0]).sum() - 1
+    bins = np.clip(bins, 0, N_BINS - 1)
+
+    n_sdoh = len(sdoh_options)
+    sdoh_levels = np.where(missing[:, :n_sdoh], np.nan, SDOH_COLOR_LEVELS[bins[:, :n_sdoh]])
+    lab_colors = np.where(missing[:, n_sdoh:], MISSING_LAB_COLOR, sample_colorscale(lab_colorscale, N_BINS)[bins[:, n_sdoh:]])
+
+    colors = pd.concat([pd.DataFrame(sdoh_levels, index=sdoh.index, columns=sdoh_options),
+                        pd.DataFrame(lab_colors, index=sdoh.index, columns=lab_options)], axis=1)
+    colors = colors.add_prefix("color_")
+
+    ticktexts = np.rint(edges[TICK_QUANTILES, :n_sdoh]).astype(int)
+
+    return Tables(colors=colors,
+                  ticktexts={column: ticktexts[:, j] for j, column in enumerate(sdoh_options)},
+                  ranges={column: (minimums[j], maximums[j]) for j, column in enumerate(columns)},
+                  edges=pd.DataFrame(edges, index=QUANTILES, columns=columns))
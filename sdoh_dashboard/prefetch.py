@@ -0,0 +1,84 @@
+import uuid
+import weakref
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from . import config
+from .metadata import sdoh_options, lab_options
+
+
+# Speculative Prefetch of the Next Selections
+# While a session looks at a selection pair, the figures of the pairs it is likely to pick next are built in
+# the background and stored in the shared figure cache, so that picking one of them is a cache hit (a pick
+# of a pair still being built waits for that build instead of starting another one). The budget:
+#   - PREFETCH_WORKERS threads build at once, the other builds are queued
+#   - a session has one batch of builds queued at most: its next selection cancels what was not started
+#   - a prefetched figure only takes a free slot of the figure cache, it never evicts a figure
+#   - the queued builds of a session are cancelled when the session ends
+
+
+# Pairs likely to be picked after (lab_selection, sdoh_selection): the other labs with the same SDOH, then the
+# SDOHs next to it in the menu (up to distance entries above and below) with the same lab, nearest first
+def neighbours(lab_selection, sdoh_selection, distance=config.PREFETCH_DISTANCE):
+    pairs = [(lab, sdoh_selection) for lab in lab_options if lab != lab_selection]
+    position = sdoh_options.index(sdoh_selection)
+    for step in range(1, distance + 1):
+        for neighbour in (position + step, position - step):
+            if 0 <= neighbour < len(sdoh_options):
+                pairs.append((lab_selection, sdoh_options[neighbour]))
+    return pairs
+
+
+# A session's handle, held by the session: its queued builds are cancelled once it is garbage collected
+class Session:
+
+    def __init__(self, prefetcher):
+        self.id = uuid.uuid4().hex[:12]
+        weakref.finalize(self, prefetcher.cancel, self.id)
+
+
+class Prefetcher:
+
+    def __init__(self, cache, workers=config.PREFETCH_WORKERS):
+        self.cache = cache
+        self.submitted = 0
+        self.cancelled = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sdoh-prefetch") if workers > 0 else None
+        self._pending = {}          # session id -> futures of its last batch
+        self._lock = threading.Lock()
+
+    def session(self):
+        return Session(self)
+
+    # Queues the builds, (key, build) pairs, of the figures not cached yet. They replace the session's queued ones.
+    def submit(self, session, builds):
+        if self._executor is None:
+            return
+        with self._lock:
+            self._cancel(session.id)
+            futures = [self._executor.submit(self._build, key, build) for key, build in builds if key not in self.cache]
+            self._pending[session.id] = futures
+            self.submitted += len(futures)
+
+    def _build(self, key, build):
+        try:
+            self.cache.prefetch(key, build)
+        except Exception:
+            traceback.print_exc()
+
+    # Cancels a session's queued builds, a build already started completes
+    def cancel(self, session_id):
+        with self._lock:
+            self._cancel(session_id)
+
+    def _cancel(self, session_id):
+        for future in self._pending.pop(session_id, ()):
+            if future.cancel():
+                self.cancelled += 1
+
+    def stats(self):
+        with self._lock:
+            return {"submitted": self.submitted,
+                    "cancelled": self.cancelled,
+                    "sessions": len(self._pending)}
@@ -0,0 +1,271 @@
+import io
+import sys
+import json
+import argparse
+import threading
+import traceback
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from . import config, dataset
+from .association import MISSING_LAB_VALUE
+from .metadata import sdoh_options, lab_options, dict_Labels
+
+
+# Query Layer over the Dataset
+# Answers the lab and SDOH values of sets of municipios, ranked or filtered, without drawing a map. A Store is
+# built once per dataset version from the frame load_data() returns, and keeps:
+#   - a COUNTYFIPS index: the rows of a set of municipios in one lookup each
+#   - per measure column, the row order sorting its values (missing values left out, as well as the labs'
+#     MISSING_LAB_VALUE placeholders) and the sorted values:
+#     top-k is a slice of the order, a range filter two binary searches, a percentile one
+# It is served as JSON, CSV or Parquet by a local HTTP endpoint, started by the app with SDOH_QUERY_PORT or
+# on its own, reading the current dataset:
+#
+#   python -m sdoh_dashboard.query --port 8600
+#   curl "localhost:8600/query?columns=ACS_PCT_INC50_ABOVE65&fips=72001,72003"
+#   curl "localhost:8600/query?column=creatinine_serum&min=1.0&max=1.5&format=csv"
+#   curl "localhost:8600/query?column=albumin_urine&top=10"                 # highest first, order=asc for lowest
+#   curl "localhost:8600/percentile?column=ACS_PCT_INC50_ABOVE65&value=30"   # or q=90 for the value at 90%
+#   curl "localhost:8600/columns"
+KEY_COLUMNS = ["COUNTYFIPS", "COUNTY"]
+MEASURES = list(lab_options) + list(sdoh_options)
+FORMATS = {"json": "application/json",
+           "csv": "text/csv; charset=utf-8",
+           "parquet": "application/vnd.apache.parquet"}
+CSV_CHUNK_ROWS = 10_000
+
+
+class Store:
+
+    def __init__(self, data, version=None):
+        self.version = version
+        self.data = data[KEY_COLUMNS + [column for column in MEASURES if column in data.columns]]
+        self.measures = [column for column in MEASURES if column in data.columns]
+        self.index = pd.Index(self.data["COUNTYFIPS"])
+        self.orders, self.sorted = {}, {}
+        for column in self.measures:
+            values = self.data[column].to_numpy(dtype=float)
+            missing = np.isnan(values) | ((values == MISSING_LAB_VALUE) if column in lab_options else False)
+            present = np.flatnonzero(~missing)
+            order = present[np.argsort(values[present], kind="stable")]
+            self.orders[column] = order
+            self.sorted[column] = values[order]
+
+    def _check(self, column):
+        if column not in self.orders:
+            raise ValueError("Unknown column %r, one of: %s" % (column, ", ".join(self.measures)))
+
+    # Row positions of the municipios, in the given order. Unknown FIPS raise a ValueError.
+    def rows(self, fips):
+        positions = self.index.get_indexer(list(fips))
+        if (positions < 0).any():
+            raise ValueError("Unknown COUNTYFIPS: %s" % ", ".join(np.asarray(fips)[positions < 0]))
+        return positions
+
+    # Row positions of the k highest values of a column (lowest with ascending), missing values excluded
+    def top(self, column, k, ascending=False):
+        self._check(column)
+        order = self.orders[column]
+        return order[:k] if ascending else order[::-1][:k]
+
+    # Row positions of the values of a column in [low, high] (either bound can be None), in ascending order
+    def between(self, column, low=None, high=None):
+        self._check(column)
+        values = self.sorted[column]
+        start = 0 if low is None else np.searchsorted(values, low, side="left")
+        stop = len(values) if high is None else np.searchsorted(values, high, side="right")
+        return self.orders[column][start:max(start, stop)]
+
+    # Percentage of the municipios (with a value) whose value of the column is at most value
+    def percentile(self, column, value):
+        self._check(column)
+        values = self.sorted[column]
+        return 100.0 * np.searchsorted(values, value, side="right") / len(values) if len(values) else float("nan")
+
+    # Value of the column at the q-th percentile (0-100, nearest rank)
+    def quantile(self, column, q):
+        self._check(column)
+        values = self.sorted[column]
+        if not len(values):
+            return float("nan")
+        return float(values[min(len(values) - 1, max(0, int(np.ceil(q / 100.0 * len(values))) - 1))])
+
+    # Rows of the municipios in fips (all by default). With a column: those with a value in [low, high], ranked
+    # by it (descending unless ascending, missing values left out) and cut to the top k. Returns COUNTYFIPS,
+    # COUNTY and the given columns (every measure by default).
+    def query(self, columns=None, fips=None, column=None, low=None, high=None, top=None, ascending=False):
+        columns = list(columns or self.measures)
+        for name in columns:
+            self._check(name)
+
+        if column is None:
+            if low is not None or high is not None or top is not None:
+                raise ValueError("min, max and top need a column")
+            positions = self.rows(fips) if fips is not None else np.arange(len(self.data))
+        else:
+            positions = self.between(column, low, high)
+            positions = positions if ascending else positions[::-1]
+            if fips is not None:
+                positions = positions[np.isin(positions, self.rows(fips))]
+            if top is not None:
+                positions = positions[:top]
+            if column not in columns:
+                columns.insert(0, column)
+
+        return self.data.iloc[positions][KEY_COLUMNS + columns].reset_index(drop=True)
+
+    def columns(self):
+        return [{"name": column, "label": dict_Labels.get(column, column),
+                 "kind": "lab" if column in lab_options else "sdoh",
+                 "count": len(self.sorted[column])}
+                for column in self.measures]
+
+
+# A query's result as Parquet bytes
+def to_parquet(frame):
+    buffer = io.BytesIO()
+    frame.to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+
+# A query's result as CSV, chunk by chunk (header first)
+def iter_csv(frame, chunk_rows=CSV_CHUNK_ROWS):
+    for start in range(0, max(len(frame), 1), chunk_rows):
+        yield frame.iloc[start:start + chunk_rows].to_csv(index=False, header=start == 0).encode()
+
+
+def _list(parameters, name):
+    value = parameters.get(name)
+    return [item for item in value[-1].split(",") if item] if value else None
+
+
+def _number(parameters, name, kind=float):
+    value = parameters.get(name)
+    if not value:
+        return None
+    try:
+        return kind(value[-1])
+    except ValueError:
+        raise ValueError("%s must be a number, not %r" % (name, value[-1])) from None
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"       # chunked CSV responses
+    store = None                        # function returning the current Store, set by serve()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, content_type, chunks, length=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if length is None:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Content-Length", str(length))
+        self.end_headers()
+        for chunk in chunks:
+            if length is None:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            else:
+                self.wfile.write(chunk)
+        if length is None:
+            self.wfile.write(b"0\r\n\r\n")
+
+    def _json(self, value, status=200):
+        body = json.dumps(value, allow_nan=False, default=float).encode()
+        self._send(status, FORMATS["json"], [body], len(body))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parameters = parse_qs(url.query)
+        try:
+            store = type(self).store()
+            if url.path == "/columns":
+                return self._json({"version": store.version, "columns": store.columns()})
+
+            if url.path == "/percentile":
+                column = (parameters.get("column") or [None])[-1]
+                value, q = _number(parameters, "value"), _number(parameters, "q")
+                if column is None or (value is None) == (q is None):
+                    raise ValueError("percentile needs a column, and a value or q")
+                result = ({"value": value, "percentile": store.percentile(column, value)} if q is None else
+                          {"q": q, "value": store.quantile(column, q)})
+                return self._json({"version": store.version, "column": column, **result})
+
+            if url.path == "/query":
+                format = (parameters.get("format") or ["json"])[-1]
+                if format not in FORMATS:
+                    raise ValueError("format must be one of: %s" % ", ".join(FORMATS))
+                frame = store.query(columns=_list(parameters, "columns"),
+                                    fips=_list(parameters, "fips"),
+                                    column=(parameters.get("column") or [None])[-1],
+                                    low=_number(parameters, "min"),
+                                    high=_number(parameters, "max"),
+                                    top=_number(parameters, "top", int),
+                                    ascending=(parameters.get("order") or ["desc"])[-1] == "asc")
+                if format == "csv":
+                    return self._send(200, FORMATS["csv"], iter_csv(frame))
+                if format == "parquet":
+                    body = to_parquet(frame)
+                    return self._send(200, FORMATS["parquet"], [body], len(body))
+                records = json.loads(frame.to_json(orient="records", double_precision=6))
+                return self._json({"version": store.version, "rows": records})
+
+            self._json({"error": "Not found, use /query, /percentile or /columns"}, 404)
+
+        except ValueError as error:
+            self._json({"error": str(error)}, 400)
+
+        except Exception as error:
+            traceback.print_exc()
+            self._json({"error": "%s: %s" % (type(error).__name__, error)}, 500)
+
+
+# Serves the store returned by store() (called once per request, so a reloaded dataset is picked up) on
+# host:port in a daemon thread. Returns the server, server.shutdown() stops it.
+def serve(store, port, host=config.QUERY_HOST):
+    handler = type("StoreHandler", (Handler,), {"store": staticmethod(store)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="sdoh-query", daemon=True).start()
+    return server
+
+
+# Store of the current dataset, rebuilt when its files change (used without the app)
+def current_store():
+    signature = dataset.signature()
+    with _current_lock:
+        if _current.get("signature") != signature:
+            data = dataset.read(KEY_COLUMNS + MEASURES)
+            _current.update(signature=signature, store=Store(data, dataset.version(data)))
+        return _current["store"]
+
+
+_current = {}
+_current_lock = threading.Lock()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serves the lab and SDOH values of the dataset over HTTP.")
+    parser.add_argument("--host", default=config.QUERY_HOST)
+    parser.add_argument("--port", type=int, default=config.QUERY_PORT or 8600)
+    args = parser.parse_args(argv)
+
+    store = current_store()
+    server = serve(current_store, args.port, args.host)
+    print("Serving %d municipios x %d columns (version %s) on http://%s:%d"
+          % (len(store.data), len(store.measures), store.version, args.host, server.server_address[1]))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import time
+import hashlib
+import threading
+import traceback
+
+from . import config
+
+
+# Hot Reload of the Data Files
+# A background thread polls the signatures (path, mtime, size) of every source: dataset, geometry, census
+# tracts, bundle. A source whose signature changed, and stayed the same for one more poll (so a file being
+# copied is not read half-written), is hashed: a touched but identical file keeps the published signature.
+# For a changed content:
+#   1. warm(changed, signatures) rebuilds what depends on the changed sources, keyed by the new signatures,
+#      while every session keeps using the published ones
+#   2. the new signatures are published in a single assignment
+#   3. drop(changed, old, new) removes the artifacts of the old signatures
+# A rerun reads the published signatures once, so it sees either the old or the new state, never a mix.
+# A failed warm keeps the old state published, until the files change again.
+class Watcher:
+
+    def __init__(self, sources, warm, drop, interval=config.RELOAD_INTERVAL):
+        self.sources = sources          # name -> function returning the source's signature
+        self.warm = warm
+        self.drop = drop
+        self.interval = interval
+        self.reloads = 0
+        self.signatures = {name: signature() for name, signature in sources.items()}
+        self._digests = {name: self._digest(signature) for name, signature in self.signatures.items()}
+        self._seen = dict(self.signatures)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Content hash of a signature's files, None when one of them cannot be read
+    @staticmethod
+    def _digest(signature):
+        digest = hashlib.sha1()
+        try:
+            for path, _, _ in signature:
+                with open(path, "rb") as file:
+                    while chunk := file.read(1 << 20):
+                        digest.update(chunk)
+
+        except OSError:
+            return None
+
+        return digest.hexdigest()
+
+    # One check of every source, returns the names of the sources reloaded. settle=False acts on a change
+    # without waiting for the next poll.
+    def poll(self, settle=True):
+        with self._lock:
+            fresh = {name: signature() for name, signature in self.sources.items()}
+            changed = {name for name, signature in fresh.items() if signature != self._seen[name]}
+            settled = {name for name in changed if not settle or self._pending.get(name) == fresh[name]}
+            self._pending = {name: fresh[name] for name in changed - settled}
+            self._seen.update((name, fresh[name]) for name in settled)
+
+            # A touched but identical file keeps its published signature, and what was built from it
+            digests = {name: self._digest(fresh[name]) for name in settled}
+            reloaded = {name for name in settled if digests[name] is None or digests[name] != self._digests[name]}
+            if not reloaded:
+                return set()
+
+            new = dict(self.signatures)
+            new.update((name, fresh[name]) for name in reloaded)
+            start = time.perf_counter()
+            try:
+                self.warm(reloaded, new)
+
+            except Exception:
+                print("Failed to reload %s, still serving the previous files:" % ", ".join(sorted(reloaded)))
+                traceback.print_exc()
+                return set()
+
+            old, self.signatures = self.signatures, new
+            self._digests.update((name, digests[name]) for name in reloaded)
+            self.reloads += 1
+            self.drop(reloaded, old, new)
+            print("Reloaded %s in %.2f s" % (", ".join(sorted(reloaded)), time.perf_counter() - start))
+            return reloaded
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                traceback.print_exc()
+
+    # Polls every interval seconds in a daemon thread, an interval of 0 leaves polling to the caller
+    def start(self):
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sdoh-reload", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
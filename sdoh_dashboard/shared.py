@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+
+# Read-only Shared Resources
+# The dataset, geometry and precomputed tables are held once per process and handed to every session
+# without copying, so they are frozen: a session that tries to modify their values gets an error, or a copy,
+# instead of silently changing what the other sessions see.
+
+
+# Dict that refuses modifications, still a dict for json and Plotly
+class FrozenDict(dict):
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("shared resource is read-only")
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+    __ior__ = _readonly
+
+    # Immutable all the way down, so copies can be the same object (figures then share the geometry)
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+# Nested dicts/lists (e.g. GeoJSON) as FrozenDicts/tuples
+def freeze_json(value):
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze_json(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze_json(item) for item in value)
+    return value
+
+
+def _freeze_array(values):
+    if isinstance(values, np.ndarray):
+        values.flags.writeable = False
+    return values
+
+
+# Same DataFrame over non-writeable arrays (no copy). Shared frames rely on pandas Copy-on-Write, turned on for the
+# process here: a column, selection or result taken from them is a lazy copy, so in-place changes made through it
+# (e.g. frame["COUNTY"].replace(..., inplace=True)) copy its values first, and writing into the frame's own values
+# raises. Changing the columns of the shared frame itself (assigning, dropping or renaming one, its in-place
+# methods) is not guarded: sessions work on copies (frame.copy() is cheap under Copy-on-Write).
+def freeze_frame(frame):
+    pd.set_option("mode.copy_on_write", True)
+    columns = {}
+    for name, column in frame.items():
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            codes = _freeze_array(column.cat.codes.to_numpy())
+            columns[name] = pd.Categorical.from_codes(codes, dtype=column.dtype)
+        else:
+            columns[name] = _freeze_array(column.to_numpy())
+    return pd.DataFrame(columns, index=frame.index, copy=False)
+
+
+# precompute.Tables over frozen frames and arrays
+def freeze_tables(tables):
+    return tables._replace(colors=freeze_frame(tables.colors),
+                           ticktexts=FrozenDict((key, _freeze_array(value)) for key, value in tables.ticktexts.items()),
+                           ranges=FrozenDict(tables.ranges),
+                           edges=freeze_frame(tables.edges))
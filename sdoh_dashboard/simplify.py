@@ -0,0 +1,207 @@
+from typing import NamedTuple
+
+import numpy as np
+
+
+# Topology-preserving simplification of the counties GeoJSON
+#
+# Rings are split into arcs at junctions (points where neighbouring municipios meet), every
+# shared border becomes a single arc used by both municipios, and each arc is simplified once.
+# Both sides of a border therefore always keep exactly the same vertices.
+#
+# The Douglas-Peucker "importance" of every vertex is computed once per geometry, so any
+# tolerance (or vertex budget) is just a threshold over those importances.
+
+
+class Topology(NamedTuple):
+    features: list       # features without coordinates: (feature, geometry type, [[ring id, ...], ...])
+    rings: list          # per ring: [(arc id, reversed), ...]
+    arcs: list           # per arc: (n, 2) array of lon/lat points
+    importances: list    # per arc: (n,) array, vertices are kept while importance > tolerance
+    references: np.ndarray  # per arc: number of rings using it
+
+
+# Distance from every point to the segment (start, end), or to start when both are the same point
+def _segment_distances(points, start, end):
+    segment = end - start
+    length = float(segment @ segment)
+    if length == 0.0:
+        return np.hypot(*(points - start).T)
+
+    t = np.clip(((points - start) @ segment) / length, 0.0, 1.0)
+    return np.hypot(*(points - (start + t[:, None] * segment)).T)
+
+
+# Douglas-Peucker hierarchy: the tolerance below which each vertex is kept (endpoints are always kept)
+def _importance(points):
+    n = len(points)
+    importance = np.zeros(n)
+    importance[0] = importance[-1] = np.inf
+
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        first, last, ceiling = stack.pop()
+        if last - first < 2:
+            continue
+
+        distances = _segment_distances(points[first + 1:last], points[first], points[last])
+        k = int(np.argmax(distances))
+        middle = first + 1 + k
+        importance[middle] = min(float(distances[k]), ceiling)   # a vertex never outranks its parent
+
+        stack.append((first, middle, importance[middle]))
+        stack.append((middle, last, importance[middle]))
+
+    # Closed arcs (islands, enclaves) keep at least a triangle
+    if n > 3 and tuple(points[0]) == tuple(points[-1]):
+        importance[np.argsort(importance[1:-1])[-2:] + 1] = np.inf
+
+    return importance
+
+
+# Polygons of a Polygon or MultiPolygon geometry, each a list of rings
+def polygons(geometry):
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    if geometry["type"] == "MultiPolygon":
+        return geometry["coordinates"]
+    raise ValueError("Unsupported geometry type: %s" % geometry["type"])
+
+
+# Canonical (direction-independent) key of an arc, and whether the given direction is reversed
+def _arc_key(points):
+    forward = tuple(points)
+    backward = forward[::-1]
+    return (backward, True) if backward < forward else (forward, False)
+
+
+# Splits every ring into arcs and computes the vertices' importances, run once per geometry
+def build_topology(geojson):
+    rings = []
+    for feature in geojson["features"]:
+        for polygon in polygons(feature["geometry"]):
+            for ring in polygon:
+                points = [tuple(point) for point in ring]
+                if points[0] == points[-1]:
+                    points = points[:-1]
+                rings.append(points)
+
+    # A point is a junction when it is reached from different neighbours in different rings
+    neighbours = {}
+    for points in rings:
+        m = len(points)
+        for i, point in enumerate(points):
+            neighbours.setdefault(point, set()).add(frozenset((points[i - 1], points[(i + 1) % m])))
+    junctions = {point for point, pairs in neighbours.items() if len(pairs) > 1}
+
+    arc_ids, arcs, references, ring_arcs = {}, [], [], []
+    for points in rings:
+        cuts = [i for i, point in enumerate(points) if point in junctions]
+        if not cuts:
+            # Closed ring without junctions, start at its smallest point so shared rings match
+            start = points.index(min(points))
+            rotated = points[start:] + points[:start]
+            pieces = [rotated + rotated[:1]]
+            reverse_closed = tuple(rotated[1:]) > tuple(rotated[:0:-1])
+        else:
+            rotated = points[cuts[0]:] + points[:cuts[0]]
+            cuts = [i - cuts[0] for i in cuts] + [len(points)]
+            rotated = rotated + rotated[:1]
+            pieces = [rotated[a:b + 1] for a, b in zip(cuts, cuts[1:])]
+            reverse_closed = None
+
+        used = []
+        for piece in pieces:
+            if reverse_closed is None:
+                key, reversed_ = _arc_key(piece)
+            else:
+                reversed_ = reverse_closed
+                key = tuple(piece[::-1]) if reversed_ else tuple(piece)
+
+            if key not in arc_ids:
+                arc_ids[key] = len(arcs)
+                arcs.append(np.array(key, dtype=float))
+                references.append(0)
+            references[arc_ids[key]] += 1
+            used.append((arc_ids[key], reversed_))
+        ring_arcs.append(used)
+
+    features, ring_id = [], 0
+    for feature in geojson["features"]:
+        ring_ids = []
+        for polygon in polygons(feature["geometry"]):
+            ring_ids.append(list(range(ring_id, ring_id + len(polygon))))
+            ring_id += len(polygon)
+        shell = {key: value for key, value in feature.items() if key != "geometry"}
+        features.append((shell, feature["geometry"]["type"], ring_ids))
+
+    return Topology(features=features,
+                    rings=ring_arcs,
+                    arcs=arcs,
+                    importances=[_importance(arc) for arc in arcs],
+                    references=np.array(references))
+
+
+# Joins a ring's arcs end to end, dropping the repeated junction points
+def _join(arcs, used):
+    pieces = [arcs[i][::-1] if reversed_ else arcs[i] for i, reversed_ in used]
+    return np.concatenate([pieces[0]] + [piece[1:] for piece in pieces[1:]])
+
+
+# Vertices kept of every arc at a tolerance. A ring that would collapse below a valid ring (4 points) keeps its
+# arcs at full resolution, in every ring that uses them, so both sides of its borders still match.
+def _kept(topology, tolerance):
+    kept = [importance > tolerance for importance in topology.importances]
+    counts = np.array([int(mask.sum()) for mask in kept])
+    for used in topology.rings:
+        ids = [i for i, _ in used]
+        if counts[ids].sum() - (len(used) - 1) < 4:
+            for i in ids:
+                kept[i] = np.ones(len(kept[i]), dtype=bool)
+    return kept
+
+
+# Rebuilds the FeatureCollection keeping the vertices with importance above the tolerance (degrees)
+def simplify(topology, tolerance=0.0, precision=None):
+    kept = [arc[mask] for arc, mask in zip(topology.arcs, _kept(topology, tolerance))]
+    if precision is not None:
+        kept = [np.round(arc, precision) for arc in kept]
+
+    rings = [_join(kept, used).tolist() for used in topology.rings]
+
+    features = []
+    for shell, geometry_type, ring_ids in topology.features:
+        coordinates = [[rings[i] for i in polygon] for polygon in ring_ids]
+        if geometry_type == "Polygon":
+            coordinates = coordinates[0]
+        features.append({**shell, "geometry": {"type": geometry_type, "coordinates": coordinates}})
+
+    return {"type": "FeatureCollection", "features": features}
+
+
+# Number of vertices that the simplified FeatureCollection will contain for a tolerance
+def count_vertices(topology, tolerance=0.0):
+    per_arc = np.array([int(mask.sum()) for mask in _kept(topology, tolerance)])
+    joints = sum(len(used) - 1 for used in topology.rings)   # junctions shared by consecutive arcs of a ring
+    return int((per_arc * topology.references).sum()) - joints
+
+
+# Smallest tolerance that keeps the geometry within a vertex budget
+def tolerance_for_vertices(topology, vertices):
+    interior = np.concatenate([importance[1:-1] for importance in topology.importances])
+    weights = np.concatenate([np.full(len(importance) - 2, references)
+                              for importance, references in zip(topology.importances, topology.references)])
+    fixed = count_vertices(topology, np.finfo(float).max)   # endpoints and triangles that are always kept
+
+    finite = np.flatnonzero(np.isfinite(interior))
+    order = finite[np.argsort(-interior[finite], kind="stable")]
+    within = np.searchsorted(np.cumsum(weights[order]), vertices - fixed, side="right")
+    if within >= len(order):
+        return 0.0
+    return float(interior[order[within]])
+
+
+# Tolerance (degrees) of a fraction of a pixel for a map drawn at a given height and projection scale.
+# At projection_scale=1 the world's 180 degrees of latitude fill the map's height.
+def tolerance_for_height(height, projection_scale, pixels=0.5):
+    return 180.0 / (height * projection_scale) * pixels
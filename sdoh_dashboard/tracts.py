@@ -0,0 +1,112 @@
+import os
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from . import config, dataset, geometry, precompute
+from .metadata import lab_options, sdoh_options
+
+
+# Census Tract Level
+# AHRQ's tract-level SDOH file (sdoh_tract.csv, or the sdoh_tract.parquet built from it) drawn over the Census
+# tracts' GeoJSON (feature ids: 11-digit TRACTFIPS). Neither is bundled, the level is offered when both exist.
+#   - tracts are simplified like the counties (same topology and auto level of detail), so ~10x the
+#     polygons cost far less than ~10x the vertices
+#   - lab dots stay one per municipio: count-weighted averages of the tracts' labs when the tract file
+#     has them (see ingest --key TRACTFIPS), else the county dataset's averages
+TRACT_COLUMN = "TRACTFIPS"
+CSV_PATH = os.path.join(config.BASE_DIR, "sdoh_tract.csv")
+PARQUET_PATH = os.path.join(config.BASE_DIR, "sdoh_tract.parquet")
+
+GEOJSON_BUNDLED = os.path.join(config.BASE_DIR, "geojson-tracts-pr.json")
+GEOJSON_CACHE = os.path.join(config.CACHE_DIR, "geojson-tracts-pr.json")
+GEOJSON_SOURCES = (GEOJSON_BUNDLED, GEOJSON_CACHE)
+
+# Columns used by the tract map besides the selected lab and SDOH ("NAME" is added when reading)
+MAP_COLUMNS = (TRACT_COLUMN, "COUNTYFIPS", "COUNTY", "NAME")
+
+
+class TractLevel(NamedTuple):
+    data: pd.DataFrame          # one row per tract: MAP_COLUMNS, labs (NaN without data) and available SDOHs
+    version: str
+    sdoh_options: list          # SDOHs published at tract level (AHRQ's county-only sources are not)
+    tables: precompute.Tables   # tract color tables
+    dots: pd.DataFrame          # county dataset with the tracts' lab averages, one dot per municipio
+    dots_tables: precompute.Tables
+
+
+def available():
+    return (os.path.exists(PARQUET_PATH) or os.path.exists(CSV_PATH)) and \
+        any(os.path.exists(path) for path in GEOJSON_SOURCES)
+
+
+# (path, mtime, size) of the tract data and geometry files
+def signature():
+    return geometry.signature((PARQUET_PATH, CSV_PATH) + GEOJSON_SOURCES)
+
+
+def _columns(path):
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        return pq.read_schema(path).names
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+# Tract data: the map columns, every lab (NaN when not ingested) and the SDOHs the file has
+def read(parquet_path=PARQUET_PATH, csv_path=CSV_PATH):
+    path = parquet_path if os.path.exists(parquet_path) else csv_path
+    stored = set(_columns(path))
+    columns = [TRACT_COLUMN, "COUNTYFIPS", "COUNTY"] + [column for column in list(lab_options) + list(sdoh_options)
+                                                        if column in stored]
+    frame = dataset.read(columns, parquet_path=parquet_path, csv_path=csv_path)
+
+    for lab in lab_options:
+        if lab not in frame:
+            frame[lab] = np.float32("nan")
+
+    # Hover title: "Census Tract 9501.01, Adjuntas"
+    code = frame[TRACT_COLUMN].str[-6:]
+    frame["NAME"] = ("Census Tract " + code.str[:4].str.lstrip("0") + np.where(code.str[4:] == "00", "", "." + code.str[4:])
+                     + ", " + frame["COUNTY"].astype(str))
+    return frame
+
+
+# County dataset with each lab replaced by the count-weighted average of its tracts, for the labs ingested at
+# tract level (the weights are the "<lab>_count" columns when present)
+def county_dots(tracts, counties, parquet_path=PARQUET_PATH, csv_path=CSV_PATH):
+    path = parquet_path if os.path.exists(parquet_path) else csv_path
+    stored = set(_columns(path))
+    counts = [lab + "_count" for lab in lab_options if lab + "_count" in stored]
+    weights = dataset.read([TRACT_COLUMN] + counts, parquet_path=parquet_path, csv_path=csv_path) if counts else None
+
+    averages = {}
+    for lab in lab_options:
+        values = tracts[lab].astype(float)
+        if values.isna().all():
+            continue
+        weight = weights[lab + "_count"].astype(float) if lab + "_count" in counts else pd.Series(1.0, index=values.index)
+        weight = weight.where(values.notna(), 0.0)
+        totals = pd.DataFrame({"sum": values.fillna(0.0) * weight, "weight": weight}).groupby(tracts["COUNTYFIPS"]).sum()
+        averages[lab] = (totals["sum"] / totals["weight"].where(totals["weight"] > 0)).reindex(counties["COUNTYFIPS"])
+
+    return counties.assign(**{lab: average.to_numpy(dtype="float32") for lab, average in averages.items()})
+
+
+# Tract data, tables and lab dots, given the county dataset
+def load(counties, lab_colorscale, parquet_path=PARQUET_PATH, csv_path=CSV_PATH):
+    data = read(parquet_path, csv_path)
+    options = [column for column in sdoh_options if column in data and data[column].notna().any()]
+    dots = county_dots(data, counties, parquet_path, csv_path)
+
+    return TractLevel(data=data,
+                      version=dataset.version(data),
+                      sdoh_options=options,
+                      tables=precompute.precompute(data, options, lab_options, lab_colorscale),
+                      dots=dots,
+                      dots_tables=precompute.precompute(dots, sdoh_options, lab_options, lab_colorscale))
+
+
+# Tracts at the selected level of detail (never downloaded)
+def load_tracts(fips, detail=config.MAP_DETAIL, vertices=config.MAP_VERTICES, sources=GEOJSON_SOURCES):
+    return geometry.load_counties(fips, detail, vertices, allow_network=False, sources=sources)